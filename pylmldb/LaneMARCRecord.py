@@ -48,15 +48,69 @@ class LaneMARCRecord(Record):
     def get_all_categories(self):
         return [val for field in self.get_fields('655') for val in field.get_subfields('a') if field.indicator1 not in '78']
 
-    def get_isbns(self):
-        isbn_vals = self.get_subfields('020',('a','z')) + [val for field in self.get_fields('024') for val in field.get_subfields('a','z') if field.indicator1 == '3']
-        # wipe all parentheticals and anything after colon/dollar sign/v; nums + X only
-        return [re.sub(r'[^\dX]', '', re.sub(r'[\(:\$Vv].*', '', val).upper()) for val in isbn_vals]
+    # wipe all parentheticals and anything after colon/dollar sign/v; nums + X only
+    IDENTIFIER_QUALIFIER_RE = re.compile(r'[\(:\$Vv].*')
+    IDENTIFIER_NON_DIGIT_RE = re.compile(r'[^\dX]')
 
-    def get_issns(self):
-        issn_vals = self.get_subfields('022',('a','l','m','y','z'))
-        # wipe all parentheticals and anything after colon/dollar sign/v; nums + X only
-        return [re.sub(r'[^\dX]', '', re.sub(r'[\(:\$Vv].*', '', val).upper()) for val in issn_vals]
+    @classmethod
+    def clean_identifier(cls, val):
+        return cls.IDENTIFIER_NON_DIGIT_RE.sub('', cls.IDENTIFIER_QUALIFIER_RE.sub('', val).upper())
+
+    def get_isbns(self, valid_only=False):
+        # ^z: canceled/invalid
+        codes = ('a',) if valid_only else ('a','z')
+        isbn_vals = self.get_subfields('020',codes) + [val for field in self.get_fields('024') for val in field.get_subfields(*codes) if field.indicator1 == '3']
+        return [self.clean_identifier(val) for val in isbn_vals]
+
+    def get_issns(self, valid_only=False):
+        # ^l: ISSN-L (linking), ^m: canceled ISSN-L, ^y: incorrect, ^z: canceled
+        codes = ('a',) if valid_only else ('a','l','m','y','z')
+        issn_vals = self.get_subfields('022',codes)
+        return [self.clean_identifier(val) for val in issn_vals]
+
+    ISBN, ISSN = 'isbn', 'issn'
+    def get_identifiers(self):
+        """
+        Returns set of (ISBN|ISSN, normalized value) for this record's own
+        (^a) identifiers, with all ISBNs canonicalized to ISBN-13;
+        canceled/invalid and linking identifiers are left out.
+        """
+        identifiers = set()
+        for isbn in self.get_isbns(valid_only=True):
+            isbn = self.normalize_isbn(isbn)
+            if isbn is not None:
+                identifiers.add((self.ISBN, isbn))
+        for issn in self.get_issns(valid_only=True):
+            issn = self.normalize_issn(issn)
+            if issn is not None:
+                identifiers.add((self.ISSN, issn))
+        return identifiers
+
+    @classmethod
+    def normalize_isbn(cls, val):
+        """
+        Cleans ISBN-10 or -13 string and converts to ISBN-13.
+        Returns None if not the shape of an ISBN (check digits are not validated).
+        """
+        val = cls.clean_identifier(val)
+        if len(val) == 10 and val[:9].isdigit():
+            val = '978' + val[:9]
+            # ISBN-13 check digit: weights alternate 1, 3
+            checksum = sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(val))
+            return val + str((10 - checksum % 10) % 10)
+        elif len(val) == 13 and val.isdigit():
+            return val
+        return None
+
+    @classmethod
+    def normalize_issn(cls, val):
+        """
+        Cleans ISSN string. Returns None if not the shape of an ISSN.
+        """
+        val = cls.clean_identifier(val)
+        if len(val) == 8 and val[:7].isdigit():
+            return val
+        return None
 
     def is_referential(self):
         if '008' not in self:
@@ -226,6 +280,22 @@ class LaneMARCRecord(Record):
             variant_types_and_ids.add((element_type, variant_id_string))
         return list(variant_types_and_ids)
 
+    def get_search_headings(self):
+        """
+        Returns list of element types, variant flags, and normalized
+        heading strings (subfield values only, space-separated)
+        for this record's authorized form and its variants,
+        for full-text indexing.
+        """
+        headings = []
+        _, element_type, identity_string, authorized_form = self.get_identity_information()
+        if authorized_form:
+            headings.append((element_type, False, self.normalize(' '.join(authorized_form.split(self.UNNORMALIZED_SEP)[1::2]))))
+        for variant_type, variant_id_string in self.get_variant_types_and_ids(normalized=True):
+            if variant_id_string:
+                headings.append((variant_type, True, ' '.join(val for val in variant_id_string.split(self.NORMALIZED_SEP)[1::2] if val)))
+        return headings
+
 
     DIGITAL, PHYSICAL, COMPONENT = 'digi', 'phys', 'comp'
     def get_holdings_type(self):
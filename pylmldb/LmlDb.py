@@ -8,8 +8,9 @@ from loguru import logger
 # ORM model specs
 
 import sqlalchemy
-from sqlalchemy import Column, String, Integer, Binary
+from sqlalchemy import Column, String, Integer, Binary, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.dialects.postgresql import insert, ARRAY
 Base = declarative_base()
 
 class Record(Base):
@@ -33,6 +34,36 @@ class HoldingsLink(Base):
     def __repr__(self):
         return f'<HoldingsLink {self.hdg_ctrlno} -> {self.bib_ctrlno}>'
 
+class Identifier(Base):
+    __tablename__ = 'identifiers'
+    __table_args__ = {'schema':'marc'}
+
+    type = Column(String(4), primary_key=True, nullable=False)
+    value = Column(String(13), primary_key=True, nullable=False)
+    bib_ctrlno = Column(Integer, primary_key=True, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<Identifier {self.type} {self.value} -> {self.bib_ctrlno}>'
+
+class Heading(Base):
+    __tablename__ = 'headings'
+    __table_args__ = (Index('headings_type_ctrlno', 'type', 'ctrlno'),
+                      {'schema':'marc'})
+
+    id = Column(Integer, primary_key=True)
+    type = Column(String(4), nullable=False)
+    ctrlno = Column(Integer, nullable=False)
+    element_type = Column(String(3))
+    variant = Column(Boolean, nullable=False)
+    text = Column(String, nullable=False)
+
+    def __repr__(self):
+        return f'<Heading {self.type} {self.ctrlno}: {self.text}>'
+
+# headings are normalized before indexing, so no stemming/stopwords
+HEADING_TSVECTOR = sqlalchemy.func.to_tsvector(sqlalchemy.literal_column("'simple'"), Heading.text)
+Index('headings_text_tsv', HEADING_TSVECTOR, postgresql_using='gin')
+
 class Version(Base):
     __tablename__ = 'version'
     __table_args__ = {'schema':'marc'}
@@ -42,8 +73,12 @@ class Version(Base):
     def __repr__(self):
         return f'<Version {self.version}>'
 
+# headings are optional, see LMLDB.create_heading_index
+CORE_TABLES = [table for table in Base.metadata.sorted_tables if table is not Heading.__table__]
+
 from .VoyagerAPI import VoyagerAPI
 from .LaneMARCRecord import LaneMARCRecord
+from .LmlDbIngest import ParallelIngest
 
 from .config import SQLALCHEMY_DATABASE_URI
 
@@ -70,6 +105,10 @@ class LMLDB:
             self.mode = 'w'
         if self.mode == 'w':
             self.__init_db()
+        elif self.mode == 'a':
+            # add any tables missing from older mirrors
+            Base.metadata.create_all(engine, tables=CORE_TABLES)
+        self.use_heading_index = engine.has_table(Heading.__tablename__, schema='marc')
         self.cache_bibmfhd_links = cache_bibmfhd_links
 
     def __enter__(self):
@@ -96,7 +135,7 @@ class LMLDB:
         # Create schema
         engine.execute("CREATE SCHEMA IF NOT EXISTS marc")
         # Create tables
-        Base.metadata.create_all(engine)
+        Base.metadata.create_all(engine, tables=CORE_TABLES)
 
     def __update_version(self) -> None:
         self.session.query(Version).delete()
@@ -127,6 +166,80 @@ class LMLDB:
         # logger.debug(f"{ctrlnos}")
         return ctrlnos
 
+    def populate_parallel(self, record_type, marc_file, **ingest_kwargs) -> list:
+        """insert records from binary ISO 2709 file, return list of ctrlnos"""
+        return ParallelIngest(self, **ingest_kwargs).run(record_type, marc_file)
+
+    def add_encoded_records(self, record_type, rows) -> None:
+        """upsert rows of (ctrlno, pickled record, derived columns) in one statement per table"""
+        if not rows:
+            return
+        # a multi-row ON CONFLICT can't touch the same row twice: last occurrence wins
+        rows = list({ ctrlno: (ctrlno, record_blob, derived) for ctrlno, record_blob, derived in rows }.values())
+        stmt = insert(Record.__table__).values([{'type': record_type,
+                                                 'ctrlno': ctrlno,
+                                                 'record': record_blob} for ctrlno, record_blob, _ in rows])
+        self.session.execute(stmt.on_conflict_do_update(
+            index_elements=[Record.type, Record.ctrlno],
+            set_={'record': stmt.excluded.record}))
+        if record_type == self.HDG:
+            stmt = insert(HoldingsLink.__table__).values([{'hdg_ctrlno': ctrlno,
+                                                           'bib_ctrlno': derived['bib_ctrlno']} for ctrlno, _, derived in rows])
+            self.session.execute(stmt.on_conflict_do_update(
+                index_elements=[HoldingsLink.hdg_ctrlno],
+                set_={'bib_ctrlno': stmt.excluded.bib_ctrlno}))
+        elif record_type == self.BIB:
+            self.session.query(Identifier) \
+                        .filter(Identifier.bib_ctrlno.in_([ctrlno for ctrlno, _, _ in rows])) \
+                        .delete(synchronize_session=False)
+            identifier_rows = [{'type': id_type, 'value': value, 'bib_ctrlno': ctrlno}
+                               for ctrlno, _, derived in rows for id_type, value in derived['identifiers']]
+            if identifier_rows:
+                self.session.execute(insert(Identifier.__table__).values(identifier_rows).on_conflict_do_nothing())
+        if self.use_heading_index and record_type != self.HDG:
+            self.session.query(Heading) \
+                        .filter(Heading.type == record_type,
+                                Heading.ctrlno.in_([ctrlno for ctrlno, _, _ in rows])) \
+                        .delete(synchronize_session=False)
+            heading_rows = [{'type': record_type, 'ctrlno': ctrlno, 'element_type': element_type,
+                             'variant': variant, 'text': text}
+                            for ctrlno, _, derived in rows for element_type, variant, text in derived['headings']]
+            if heading_rows:
+                self.session.execute(insert(Heading.__table__).values(heading_rows))
+        self.session.commit()
+
+    def __index_identifiers(self, bib_ctrlno, identifiers) -> None:
+        self.session.query(Identifier).filter_by(bib_ctrlno=bib_ctrlno).delete(synchronize_session=False)
+        for id_type, value in identifiers:
+            self.session.merge(Identifier(type=id_type, value=value, bib_ctrlno=bib_ctrlno))
+
+    def rebuild_identifier_index(self) -> None:
+        """backfill identifiers table for mirrors populated before it existed"""
+        self.session.query(Identifier).delete(synchronize_session=False)
+        for ctrlno, bib_record in self.get_bibs():
+            for id_type, value in bib_record.get_identifiers():
+                self.session.add(Identifier(type=id_type, value=value, bib_ctrlno=ctrlno))
+        self.session.commit()
+
+    def __index_headings(self, record_type, ctrlno, headings) -> None:
+        self.session.query(Heading).filter_by(type=record_type, ctrlno=ctrlno).delete(synchronize_session=False)
+        for element_type, variant, text in headings:
+            self.session.add(Heading(type=record_type, ctrlno=ctrlno, element_type=element_type,
+                                     variant=variant, text=text))
+
+    def create_heading_index(self) -> None:
+        """
+        build full-text heading index from current bibs and auts;
+        populate keeps it up to date from then on
+        """
+        Heading.__table__.create(engine, checkfirst=True)
+        self.use_heading_index = True
+        self.session.query(Heading).delete(synchronize_session=False)
+        for record_type in (self.BIB, self.AUT):
+            for ctrlno, record in self.get_records(record_type):
+                self.__index_headings(record_type, ctrlno, record.get_search_headings())
+        self.session.commit()
+
     def __add_bib(self, bib_record) -> None:
         bib_record.__class__ = LaneMARCRecord
         ctrlno = bib_record['001'].data
@@ -134,6 +247,9 @@ class LMLDB:
                             ctrlno=ctrlno,
                             record=pickle.dumps(bib_record))
         self.session.merge(record_row)
+        self.__index_identifiers(ctrlno, bib_record.get_identifiers())
+        if self.use_heading_index:
+            self.__index_headings(self.BIB, ctrlno, bib_record.get_search_headings())
     def __add_aut(self, aut_record) -> None:
         aut_record.__class__ = LaneMARCRecord
         ctrlno = aut_record['001'].data
@@ -141,6 +257,8 @@ class LMLDB:
                             ctrlno=ctrlno,
                             record=pickle.dumps(aut_record))
         self.session.merge(record_row)
+        if self.use_heading_index:
+            self.__index_headings(self.AUT, ctrlno, aut_record.get_search_headings())
     def __add_hdg(self, hdg_record) -> None:
         hdg_record.__class__ = LaneMARCRecord
         hdg_ctrlno = hdg_record['001'].data
@@ -153,14 +271,16 @@ class LMLDB:
                                    bib_ctrlno=bib_ctrlno)
         self.session.merge(hdglink_row)
 
-    def get_records(self, record_type=None, ctrlnos: list=[], batch_size: int=0):
+    def get_records(self, record_type=None, ctrlnos: list=[], batch_size: int=0, order: str='ctrlno'):
+        """
+        order: 'ctrlno', or 'input' to follow the order of ctrlnos
+        """
         assert record_type in (None, self.BIB, self.AUT, self.HDG), \
             f"invalid record type: {record_type}"
-        query = self.session.query(Record).order_by(Record.ctrlno)
+        query = self.session.query(Record)
         if record_type is not None:
             query = query.filter_by(type=record_type)
-        if ctrlnos:
-            query = query.filter(Record.ctrlno.in_(ctrlnos))
+        query = self.__filter_ctrlnos(query, ctrlnos, order)
         if batch_size > 0:
             # return lists of size batch_size, of tuples
             query = query.limit(batch_size)
@@ -176,12 +296,130 @@ class LMLDB:
             for record in query:
                 yield record.ctrlno, pickle.loads(record.record)
 
-    def get_bibs(self, ctrlnos: list=[], batch_size: int=0):
-        return self.get_records(self.BIB, ctrlnos, batch_size)
-    def get_auts(self, ctrlnos: list=[], batch_size: int=0):
-        return self.get_records(self.AUT, ctrlnos, batch_size)
-    def get_hdgs(self, ctrlnos: list=[], batch_size: int=0):
-        return self.get_records(self.HDG, ctrlnos, batch_size)
+    def get_raw_records(self, record_type=None, ctrlnos: list=[], order: str='ctrlno', ctrlno_range: tuple=None):
+        """
+        as get_records, but yield (ctrlno, pickled record bytes) without decoding;
+        ctrlno_range: only (lo, hi) inclusive
+        """
+        assert record_type in (None, self.BIB, self.AUT, self.HDG), \
+            f"invalid record type: {record_type}"
+        query = self.session.query(Record.ctrlno, Record.record)
+        if record_type is not None:
+            query = query.filter_by(type=record_type)
+        if ctrlno_range is not None:
+            query = query.filter(Record.ctrlno.between(*ctrlno_range))
+        query = self.__filter_ctrlnos(query, ctrlnos, order)
+        for ctrlno, record_blob in query.yield_per(1000):
+            yield ctrlno, record_blob
+
+    def get_ctrlno_ranges(self, record_type, n: int) -> list:
+        """(lo, hi) of up to n contiguous ctrlno ranges of record_type, of about equal record counts"""
+        shards = self.session.query(Record.ctrlno,
+                                    sqlalchemy.func.ntile(n).over(order_by=Record.ctrlno).label('shard')) \
+                             .filter_by(type=record_type) \
+                             .subquery()
+        query = self.session.query(sqlalchemy.func.min(shards.c.ctrlno), sqlalchemy.func.max(shards.c.ctrlno)) \
+                            .group_by(shards.c.shard) \
+                            .order_by(shards.c.shard)
+        return [(lo, hi) for lo, hi in query]
+
+    # above this many, ctrlnos are bound as a single array instead of an IN list
+    LARGE_CTRLNO_SET = 1000
+    def __filter_ctrlnos(self, query, ctrlnos: list, order: str):
+        assert order in ('ctrlno', 'input'), f"invalid order: {order}"
+        if not ctrlnos:
+            return query.order_by(Record.ctrlno)
+        ctrlnos = list(dict.fromkeys(int(ctrlno) for ctrlno in ctrlnos))
+        if order == 'input':
+            # join against the unnested array, keeping each ctrlno's position
+            ctrlno_set = sqlalchemy.text("SELECT * FROM unnest(:ctrlnos) WITH ORDINALITY AS t(ctrlno, position)") \
+                                   .bindparams(sqlalchemy.bindparam('ctrlnos', value=ctrlnos, type_=ARRAY(Integer))) \
+                                   .columns(ctrlno=Integer, position=Integer) \
+                                   .alias('ctrlno_set')
+            return query.join(ctrlno_set, ctrlno_set.c.ctrlno == Record.ctrlno) \
+                        .order_by(ctrlno_set.c.position)
+        elif len(ctrlnos) > self.LARGE_CTRLNO_SET:
+            return query.filter(Record.ctrlno == sqlalchemy.any_(sqlalchemy.literal(ctrlnos, ARRAY(Integer)))) \
+                        .order_by(Record.ctrlno)
+        return query.filter(Record.ctrlno.in_(ctrlnos)).order_by(Record.ctrlno)
+
+    def get_bibs(self, ctrlnos: list=[], batch_size: int=0, order: str='ctrlno'):
+        return self.get_records(self.BIB, ctrlnos, batch_size, order)
+    def get_auts(self, ctrlnos: list=[], batch_size: int=0, order: str='ctrlno'):
+        return self.get_records(self.AUT, ctrlnos, batch_size, order)
+    def get_hdgs(self, ctrlnos: list=[], batch_size: int=0, order: str='ctrlno'):
+        return self.get_records(self.HDG, ctrlnos, batch_size, order)
+
+    ISBN, ISSN = LaneMARCRecord.ISBN, LaneMARCRecord.ISSN
+    def get_bibs_for_identifiers(self, id_type: str, values: list) -> dict:
+        """normalized identifier value -> list of bib ctrlnos, in one query"""
+        normalize = { self.ISBN : LaneMARCRecord.normalize_isbn,
+                      self.ISSN : LaneMARCRecord.normalize_issn }.get(id_type)
+        if normalize is None:
+            raise ValueError(f'invalid id_type: {id_type}')
+        values = {normalize(value) for value in values} - {None}
+        if not values:
+            return {}
+        if len(values) > self.LARGE_CTRLNO_SET:
+            value_filter = Identifier.value == sqlalchemy.any_(sqlalchemy.literal(list(values), ARRAY(String)))
+        else:
+            value_filter = Identifier.value.in_(values)
+        query = self.session.query(Identifier.value, Identifier.bib_ctrlno) \
+                            .filter(Identifier.type == id_type, value_filter) \
+                            .order_by(Identifier.value, Identifier.bib_ctrlno)
+        results = {}
+        for value, bib_ctrlno in query:
+            results.setdefault(value, []).append(bib_ctrlno)
+        return results
+
+    def get_bibs_for_isbns(self, isbns: list) -> dict:
+        return self.get_bibs_for_identifiers(self.ISBN, isbns)
+    def get_bibs_for_issns(self, issns: list) -> dict:
+        return self.get_bibs_for_identifiers(self.ISSN, issns)
+
+    def get_identifier_clusters(self, id_type: str=None, min_size: int=2) -> list:
+        """list of (type, value, [bib ctrlnos]) for identifiers shared by >= min_size bibs"""
+        query = self.session.query(Identifier.type, Identifier.value,
+                                   sqlalchemy.func.array_agg(Identifier.bib_ctrlno))
+        if id_type is not None:
+            query = query.filter(Identifier.type == id_type)
+        query = query.group_by(Identifier.type, Identifier.value) \
+                     .having(sqlalchemy.func.count() >= min_size) \
+                     .order_by(Identifier.type, Identifier.value)
+        return [(id_type, value, sorted(bib_ctrlnos)) for id_type, value, bib_ctrlnos in query]
+
+    def search_headings(self, query: str, record_type=None, element_types: tuple=(),
+                              prefix: bool=True, limit: int=100) -> list:
+        """
+        Returns ranked list of (type, ctrlno, element_type, matched text, is variant),
+        best match per record, for headings containing all words of query.
+        With prefix, the last word may be partial.
+        """
+        assert self.use_heading_index, "no heading index (see create_heading_index)"
+        words = LaneMARCRecord.normalize(query).split()
+        if not words:
+            return []
+        # quoted lexemes, so symbols left by normalization aren't read as operators
+        ts_query = ' & '.join(f"'{word}'" for word in words)
+        if prefix:
+            ts_query += ':*'
+        ts_query = sqlalchemy.func.to_tsquery(sqlalchemy.literal_column("'simple'"), ts_query)
+        rank = sqlalchemy.func.ts_rank(HEADING_TSVECTOR, ts_query)
+        matches = self.session.query(Heading.type, Heading.ctrlno, Heading.element_type, Heading.text, Heading.variant,
+                                     rank.label('rank'),
+                                     sqlalchemy.func.row_number().over(partition_by=(Heading.type, Heading.ctrlno),
+                                                                       order_by=rank.desc()).label('rn')) \
+                              .filter(HEADING_TSVECTOR.op('@@')(ts_query))
+        if record_type is not None:
+            matches = matches.filter(Heading.type == record_type)
+        if element_types:
+            matches = matches.filter(Heading.element_type.in_(element_types))
+        matches = matches.subquery()
+        query = self.session.query(matches.c.type, matches.c.ctrlno, matches.c.element_type, matches.c.text, matches.c.variant) \
+                            .filter(matches.c.rn == 1) \
+                            .order_by(matches.c.rank.desc()) \
+                            .limit(limit)
+        return [tuple(result) for result in query]
 
     def get_bibs_for_hdg(self, hdg_ctrlno: str) -> list:
         if self.cache_bibmfhd_links:
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""
+parallel streaming bulk export of lmldb mirrors:
+each record type's ctrlnos are split into contiguous ranges (shards) by the db,
+and each shard is read, decoded and serialized by its own worker process,
+with its own db connection, into its own (compressed) output file
+"""
+
+import os, gzip, pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from loguru import logger
+from pymarc import record_to_xml
+
+from .VoyagerAPI import VoyagerAPI
+from .LmlDb import LMLDB, engine
+
+
+ISO2709, MARCXML, JSONL = 'mrc', 'xml', 'jsonl'
+
+MARCXML_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<collection xmlns="http://www.loc.gov/MARC21/slim">\n'
+MARCXML_FOOTER = b'</collection>\n'
+
+SERIALIZERS = { ISO2709 : lambda record: record.as_marc(),
+                MARCXML : lambda record: record_to_xml(record) + b'\n',
+                JSONL   : lambda record: record.as_json().encode('utf-8') + b'\n' }
+
+
+def _init_worker(db_class):
+    # forked workers must not reuse the parent's pooled postgres connections
+    if issubclass(db_class, LMLDB):
+        engine.dispose()
+
+
+def _export_shard(db_class, record_type, ctrlno_range, filename, output_format, compress):
+    # runs in worker process
+    serialize = SERIALIZERS[output_format]
+    count = 0
+    with db_class() as db, \
+         (gzip.open(filename, 'wb') if compress else open(filename, 'wb')) as outf:
+        if output_format == MARCXML:
+            outf.write(MARCXML_HEADER)
+        # streamed in ctrlno order
+        for _, record_blob in db.get_raw_records(record_type, ctrlno_range=ctrlno_range):
+            outf.write(serialize(pickle.loads(record_blob)))
+            count += 1
+        if output_format == MARCXML:
+            outf.write(MARCXML_FOOTER)
+    return filename, count
+
+
+class ParallelExport:
+    """
+    Parallel export of an LMLDB/LMLDBSQLite mirror to ISO 2709, MARCXML
+    or JSON lines, one output file per shard:
+      {prefix}.{record_type}.{shard}.{format}[.gz]
+
+    Records are stored pickled, so every format requires decoding;
+    this happens only in the workers, one record at a time.
+    """
+    def __init__(self, db_class, output_format: str=ISO2709,
+                                 prefix: str="lmldb",
+                                 processes: int=None,
+                                 shards: int=None,
+                                 compress: bool=True) -> None:
+        assert output_format in SERIALIZERS, f"invalid output_format: {output_format}"
+        self.db_class = db_class
+        self.output_format = output_format
+        self.prefix = prefix
+        self.processes = processes or os.cpu_count()
+        self.shards = shards or self.processes
+        self.compress = compress
+
+    def run(self, record_types: tuple=(VoyagerAPI.BIB, VoyagerAPI.AUT, VoyagerAPI.HDG)) -> dict:
+        """export records, return dict of output filename -> record count"""
+        results = {}
+        with ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=(self.db_class,)) as executor:
+            futures = []
+            with self.db_class() as db:
+                for record_type in record_types:
+                    for shard, ctrlno_range in enumerate(db.get_ctrlno_ranges(record_type, self.shards)):
+                        filename = f"{self.prefix}.{record_type}.{shard:04d}.{self.output_format}"
+                        if self.compress:
+                            filename += '.gz'
+                        futures.append(executor.submit(_export_shard, self.db_class, record_type,
+                                                       ctrlno_range, filename,
+                                                       self.output_format, self.compress))
+            for future in as_completed(futures):
+                filename, count = future.result()
+                logger.info(f"exported {count} records to {filename}")
+                results[filename] = count
+        return results
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+import os, pickle, sqlite3, zlib
+
+
+class LMLDBHistory:
+    """
+    Versioned, compressed record history for the (local) sqlite mirror
+
+    versions:
+    | version | full [1 if this change set replaced the entire mirror] |
+
+    changes:
+    | version | type | ctrlno | record [zlib-compressed pickle, NULL if deleted] |
+
+    The state of the mirror at version v is the latest full change set at
+    or before v, with every later change set up to and including v applied.
+
+    If conn is given, the history file is ATTACHed to it (as "history"),
+    so changes are committed in the same transactions as the mirror itself.
+    """
+    def __init__(self, filename, conn=None):
+        self.filename = filename
+        self.is_new = not os.path.exists(self.filename)
+        self.attached = conn is not None
+        if self.attached:
+            self.conn, self.schema = conn, 'history'
+            self.conn.execute("ATTACH DATABASE ? AS history;", (self.filename,))
+        else:
+            self.conn, self.schema = sqlite3.connect(self.filename), 'main'
+        self.cur = self.conn.cursor()
+        if self.is_new:
+            self.__init_db()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if not self.attached:
+            self.conn.close()
+
+    def __init_db(self):
+        self.cur.execute(f"""CREATE TABLE {self.schema}.versions
+                             (version INT PRIMARY KEY, full INT);""")
+        self.cur.execute(f"""CREATE TABLE {self.schema}.changes (
+                               version INT, type TEXT, ctrlno TEXT, record BLOB,
+                               PRIMARY KEY (type, ctrlno, version)
+                             );""")
+        self.cur.execute(f"CREATE INDEX {self.schema}.changes_version ON changes (version);")
+        self.conn.commit()
+
+    # ~~~~~~ WRITING ~~~~~~
+
+    def add_change(self, version, record_type, ctrlno, record_blob, compressed=False):
+        """
+        Stage a changed (record_blob = pickled record, or already
+        zlib-compressed if compressed) or deleted (record_blob = None)
+        record for the given version.
+        Committed by commit_version (or, if attached, by the mirror's next commit).
+        """
+        if record_blob is not None and not compressed:
+            record_blob = zlib.compress(record_blob)
+        self.cur.execute(f"INSERT OR REPLACE INTO {self.schema}.changes VALUES (?, ?, ?, ?);",
+                          (version, record_type, str(ctrlno), record_blob))
+
+    def seed(self, version, records):
+        """
+        Record (type, ctrlno, pickled record) for every record in the mirror
+        as a full change set, e.g. as the base for a mirror older than its history.
+        """
+        for record_type, ctrlno, record_blob in records:
+            self.add_change(version, record_type, ctrlno, record_blob)
+        self.commit_version(version, full=True)
+
+    def discard_version(self, version):
+        """
+        Drop everything staged or recorded for the given version,
+        e.g. before recording it again as a full change set.
+        """
+        self.cur.execute(f"DELETE FROM {self.schema}.changes WHERE version = ?;", (version,))
+        self.cur.execute(f"DELETE FROM {self.schema}.versions WHERE version = ?;", (version,))
+
+    def commit_version(self, version, full=False):
+        # a version that was ever a full rebuild stays one
+        self.cur.execute(f"""INSERT OR REPLACE INTO {self.schema}.versions VALUES
+                             (?, max(?, coalesce((SELECT full FROM {self.schema}.versions
+                                                  WHERE version = ?), 0)));""",
+                          (version, int(full), version))
+        self.conn.commit()
+
+    def prune(self, keep_from_version):
+        """
+        Discard history needed only to reconstruct versions before
+        keep_from_version, folding what is still in effect at that point
+        into a single full change set.
+        """
+        base = self.__get_base_version(keep_from_version)
+        if base is None:
+            # nothing recorded at or before that version; nothing to fold
+            return
+        # for each record, keep only its latest change at or before the cutoff
+        self.cur.execute(f"""DELETE FROM {self.schema}.changes
+                             WHERE version <= ? AND EXISTS (
+                               SELECT 1 FROM {self.schema}.changes AS newer
+                               WHERE newer.type = changes.type
+                                 AND newer.ctrlno = changes.ctrlno
+                                 AND newer.version > changes.version
+                                 AND newer.version <= ?);""",
+                          (keep_from_version, keep_from_version))
+        # anything left from before the last full rebuild is no longer in effect
+        self.cur.execute(f"DELETE FROM {self.schema}.changes WHERE version < ?;", (base,))
+        # deletions before the cutoff are implied once the fold is a full set
+        self.cur.execute(f"""DELETE FROM {self.schema}.changes
+                             WHERE version <= ? AND record IS NULL;""",
+                          (keep_from_version,))
+        self.cur.execute(f"""UPDATE OR REPLACE {self.schema}.changes SET version = ?
+                             WHERE version < ?;""",
+                          (keep_from_version, keep_from_version))
+        self.cur.execute(f"DELETE FROM {self.schema}.versions WHERE version < ?;",
+                          (keep_from_version,))
+        self.cur.execute(f"INSERT OR REPLACE INTO {self.schema}.versions VALUES (?, 1);",
+                          (keep_from_version,))
+        self.conn.commit()
+        self.cur.execute(f"VACUUM {self.schema};")
+
+    # ~~~~~~ READING ~~~~~~
+
+    def get_versions(self):
+        self.cur.execute(f"SELECT version FROM {self.schema}.versions ORDER BY version;")
+        return [result[0] for result in self.cur.fetchall()]
+
+    def get_changes(self, version):
+        """
+        Returns list of (type, ctrlno, deleted) for the change set of
+        the given version.
+        """
+        self.cur.execute(f"""SELECT type, ctrlno, record IS NULL FROM {self.schema}.changes
+                             WHERE version = ? ORDER BY type, ctrlno;""",
+                          (version,))
+        return [(record_type, ctrlno, bool(deleted))
+                for record_type, ctrlno, deleted in self.cur.fetchall()]
+
+    def get_record(self, record_type, ctrlno, version):
+        """
+        Returns record as it stood at the given version,
+        or None if it did not exist then.
+        """
+        base = self.__get_base_version(version)
+        if base is None:
+            return None
+        self.cur.execute(f"""SELECT record FROM {self.schema}.changes
+                             WHERE type = ? AND ctrlno = ?
+                               AND version >= ? AND version <= ?
+                             ORDER BY version DESC LIMIT 1;""",
+                          (record_type, str(ctrlno), base, version))
+        result = self.cur.fetchone()
+        if result is None or result[0] is None:
+            return None
+        return pickle.loads(zlib.decompress(result[0]))
+
+    def get_records(self, version, record_type=None):
+        """
+        Yields (type, ctrlno, pickled record bytes) for every record
+        in effect at the given version.
+        """
+        base = self.__get_base_version(version)
+        if base is None:
+            return
+        query = f"""SELECT type, ctrlno, record FROM {self.schema}.changes AS c
+                    WHERE version = (SELECT max(version) FROM {self.schema}.changes
+                                     WHERE type = c.type AND ctrlno = c.ctrlno
+                                       AND version >= ? AND version <= ?)"""
+        params = (base, version)
+        if record_type is not None:
+            query += " AND type = ?"
+            params += (record_type,)
+        # separate cursor, so callers can interleave other lookups
+        cur = self.conn.cursor()
+        cur.execute(query + " AND record IS NOT NULL;", params)
+        for record_type, ctrlno, record_blob in cur:
+            yield record_type, ctrlno, zlib.decompress(record_blob)
+
+    def reconstruct(self, version, filename):
+        """
+        Write a standalone copy of the mirror as of the given version
+        to filename, in the same layout as LMLDBSQLite.
+        """
+        from .LmlDbSQLite import LMLDBSQLite
+        if os.path.exists(filename):
+            os.remove(filename)
+        with sqlite3.connect(filename) as conn:
+            LMLDBSQLite.create_tables(conn)
+            c = conn.cursor()
+            for record_type, ctrlno, record_blob in self.get_records(version):
+                c.execute("INSERT INTO records VALUES (?, ?, ?);",
+                           (record_type, ctrlno, record_blob))
+                if record_type == LMLDBSQLite.HDG:
+                    bib_ctrlno = pickle.loads(record_blob)['004'].data
+                    c.execute("INSERT OR REPLACE INTO holdings_links VALUES (?, ?);",
+                               (ctrlno, bib_ctrlno))
+                elif record_type == LMLDBSQLite.BIB:
+                    c.executemany("INSERT OR REPLACE INTO identifiers VALUES (?, ?, ?);",
+                                   ((id_type, value, ctrlno) for id_type, value in pickle.loads(record_blob).get_identifiers()))
+            c.execute("INSERT INTO version VALUES (?);", (version,))
+            conn.commit()
+        conn.close()
+
+    def __get_base_version(self, version):
+        # latest full change set at or before version
+        self.cur.execute(f"""SELECT max(version) FROM {self.schema}.versions
+                             WHERE full = 1 AND version <= ?;""",
+                          (version,))
+        return self.cur.fetchone()[0]
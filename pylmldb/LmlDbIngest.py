@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""
+pipelined parallel ingest for lmldb mirrors:
+raw ISO 2709 records are split from the input stream in the main process,
+parsed/pickled/derived in a process pool, and handed back over a bounded
+window of pending batches to a single writer (the db object) that commits
+each batch in one go
+"""
+
+import os, pickle, zlib
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+
+from loguru import logger
+from tqdm import tqdm
+
+from .VoyagerAPI import VoyagerAPI
+from .LaneMARCRecord import LaneMARCRecord
+
+
+LEADER_LENGTH_DIGITS = 5
+END_OF_RECORD = b'\x1d'
+
+def split_marc_records(marc_file):
+    """
+    Yields raw ISO 2709 records (bytes) from a binary stream,
+    using the record length in the first five bytes of each leader.
+    """
+    while True:
+        first5 = marc_file.read(LEADER_LENGTH_DIGITS)
+        # tolerate whitespace/EOF markers between and after records
+        first5 = first5.lstrip(b' \t\r\n\x1a')
+        while first5 and len(first5) < LEADER_LENGTH_DIGITS:
+            more = marc_file.read(LEADER_LENGTH_DIGITS - len(first5))
+            if not more:
+                break
+            first5 = (first5 + more).lstrip(b' \t\r\n\x1a')
+        if not first5:
+            return
+        if len(first5) < LEADER_LENGTH_DIGITS or not first5.isdigit():
+            raise ValueError(f"invalid record length in leader: {first5!r}")
+        length = int(first5)
+        raw = first5 + marc_file.read(length - LEADER_LENGTH_DIGITS)
+        if len(raw) != length or not raw.endswith(END_OF_RECORD):
+            raise ValueError(f"truncated or malformed record ({len(raw)}/{length} bytes)")
+        yield raw
+
+
+def derive_columns(record_type, record, headings=True):
+    """
+    Values stored alongside the pickled record, computed in the worker.
+    Search headings only if the db keeps a heading index.
+    """
+    derived = {}
+    if record_type == VoyagerAPI.HDG:
+        derived['bib_ctrlno'] = record['004'].data
+    else:
+        if headings:
+            derived['headings'] = record.get_search_headings()
+        if record_type == VoyagerAPI.BIB:
+            derived['identifiers'] = sorted(record.get_identifiers())
+    return derived
+
+
+def _encode_batch(record_type, raw_records, record_kwargs, headings, compress):
+    # runs in worker process
+    rows = []
+    for raw in raw_records:
+        record = LaneMARCRecord(data=raw, **record_kwargs)
+        ctrlno = record['001'].data
+        record_blob = pickle.dumps(record)
+        derived = derive_columns(record_type, record, headings)
+        if compress:
+            # for the writer's history (see LMLDBHistory), so it doesn't compress in the write loop
+            derived['compressed_record'] = zlib.compress(record_blob)
+        rows.append((ctrlno, record_blob, derived))
+    return rows
+
+
+class ParallelIngest:
+    """
+    Parallel ingest of a binary MARC file into an LMLDB/LMLDBSQLite,
+    whose add_encoded_records method acts as the single batched writer.
+
+    At most max_pending batches are in flight at once, so reading the input
+    blocks (backpressure) whenever the writer falls behind.
+    """
+    def __init__(self, db, processes: int=None,
+                       batch_size: int=2000,
+                       max_pending: int=None,
+                       record_kwargs: dict={},
+                       progress: bool=True) -> None:
+        self.db = db
+        self.processes = processes or os.cpu_count()
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.record_kwargs = record_kwargs
+        self.progress = progress
+
+    def run(self, record_type, marc_file) -> list:
+        """insert records, return list of ctrlnos"""
+        if record_type not in (VoyagerAPI.BIB, VoyagerAPI.AUT, VoyagerAPI.HDG):
+            raise ValueError(f'invalid record_type: {record_type}')
+        ctrlnos = []
+        # only the sqlite mirror keeps a (compressed) history
+        compress = getattr(self.db, 'history', None) is not None
+        with ProcessPoolExecutor(self.processes) as executor, \
+             tqdm(desc=f"ingest {record_type}", unit='rec', disable=not self.progress) as pbar:
+            max_pending = self.max_pending or 2 * self.processes
+            pending = deque()
+            for raw_batch in self.__batches(split_marc_records(marc_file)):
+                if len(pending) >= max_pending:
+                    self.__write(record_type, pending.popleft().result(), ctrlnos, pbar)
+                pending.append(executor.submit(_encode_batch, record_type, raw_batch, self.record_kwargs,
+                                               self.db.use_heading_index, compress))
+            while pending:
+                self.__write(record_type, pending.popleft().result(), ctrlnos, pbar)
+        logger.info(f"ingested {len(ctrlnos)} {record_type} records")
+        return ctrlnos
+
+    def __batches(self, raw_records):
+        batch = []
+        for raw in raw_records:
+            batch.append(raw)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def __write(self, record_type, rows, ctrlnos, pbar) -> None:
+        self.db.add_encoded_records(record_type, rows)
+        ctrlnos.extend(ctrlno for ctrlno, _, _ in rows)
+        pbar.update(len(rows))
@@ -1,10 +1,12 @@
 #!/usr/bin/python3
 # -*- coding: UTF-8 -*-
 
-import os, shutil, re, pickle, sqlite3
+import os, re, pickle, sqlite3
 
 from .VoyagerAPI import VoyagerAPI
 from .LaneMARCRecord import LaneMARCRecord
+from .LmlDbHistory import LMLDBHistory
+from .LmlDbIngest import ParallelIngest
 
 
 class LMLDBSQLite:
@@ -17,12 +19,25 @@ class LMLDBSQLite:
     holdings_links:
     | hdg_ctrlno | bib_ctrlno |
 
+    identifiers:
+    | type [isbn|issn] | value [normalized, ISBN-13] | bib_ctrlno |
+
+    headings (optional, see create_heading_index; requires FTS5; kept through reinit):
+    | id | type | ctrlno | element_type | variant | text [normalized] |
+    + headings_fts, full-text index over headings.text
+
     version:
     | version |
+
+    Each write session's changes are also recorded as a compressed change set
+    in lml.db.history (see LMLDBHistory); full copies of lml.db.<version>
+    are only made on request (snapshot=True or make_snapshot()).
     """
-    def __init__(self, version=-1, reinit=False):
+    FILENAME = os.path.join(os.path.dirname(__file__), "..", "lml.db")
+    def __init__(self, version=-1, reinit=False, snapshot=False):
         assert isinstance(version, int) or version.isdigit()
-        self.filename = os.path.join(os.path.dirname(__file__), "..", "lml.db")
+        self.filename = self.FILENAME
+        self.history_filename = f"{self.filename}.history"
         # if version is default (-1), this is a "read-only" session
         # if version >=0 and reinit is False, this is an "update" session
         # if version >=0 and reinit is True, this is a "reinit" session
@@ -31,12 +46,35 @@ class LMLDBSQLite:
         assert not (self.read_only and reinit), \
             "cannot re-initialize without specified version"
         self.reinit = reinit
+        self.snapshot = snapshot
         # if requested (reinit flag set) or needed (lml.db missing),
-        #   re-initialize db
-        if self.reinit or not os.path.exists(self.filename):
+        #   re-initialize db; this session's changes are then the full mirror
+        self.initialized = self.reinit or not os.path.exists(self.filename)
+        if self.initialized:
+            # carry an optional heading index over to the new file
+            keep_heading_index = False
+            if os.path.exists(self.filename):
+                with sqlite3.connect(self.filename) as conn:
+                    keep_heading_index = self.__has_heading_index(conn)
+                conn.close()
             self.__init_db()
         self.conn = sqlite3.connect(self.filename)
+        # add any tables missing from older files
+        self.create_tables(self.conn)
         self.cur = self.conn.cursor()
+        self.use_heading_index = self.__has_heading_index(self.conn)
+        # temp tables for large ctrlno/value sets
+        self.value_sets, self.value_sets_free = [], []
+        if self.initialized and keep_heading_index:
+            self.create_heading_index()
+        # history is ATTACHed, so it's committed along with each write
+        self.history = None if self.read_only else LMLDBHistory(self.history_filename, conn=self.conn)
+        if self.history is not None:
+            if self.initialized:
+                # a full change set replaces anything recorded earlier at this version
+                self.history.discard_version(self.version)
+            elif self.history.is_new:
+                self.__seed_history()
 
     def __enter__(self):
         return self
@@ -44,9 +82,12 @@ class LMLDBSQLite:
     def __exit__(self, exc_type, exc_value, traceback):
         if not self.read_only:
             self.__update_version()
+            # commits the new version in both files at once
+            self.history.commit_version(self.version, full=self.initialized)
+            self.history.close()
+            if self.snapshot:
+                self.make_snapshot()
         self.conn.close()
-        if not self.read_only:
-            self.__make_backup()
 
     def __init_db(self):
         try:
@@ -55,35 +96,64 @@ class LMLDBSQLite:
             pass
         # Create tables
         with sqlite3.connect(self.filename) as conn:
-            c = conn.cursor()
-            # Create tables
-            c.execute("""CREATE TABLE records (
-                          type TEXT, ctrlno TEXT, record BLOB,
-                          PRIMARY KEY (type, ctrlno)
-                         );""")
-            c.execute("""CREATE TABLE holdings_links
-                         (hdg_ctrlno TEXT PRIMARY KEY, bib_ctrlno TEXT);""")
-            c.execute("""CREATE TABLE version
-                         (version INT);""")
-            # not bothering with FK constraints
-            conn.commit()
+            self.create_tables(conn)
+        conn.close()
+
+    @staticmethod
+    def __has_heading_index(conn):
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'headings_fts';").fetchone() is not None
+
+    @staticmethod
+    def create_tables(conn):
+        c = conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS records (
+                      type TEXT, ctrlno TEXT, record BLOB,
+                      PRIMARY KEY (type, ctrlno)
+                     );""")
+        c.execute("""CREATE TABLE IF NOT EXISTS holdings_links
+                     (hdg_ctrlno TEXT PRIMARY KEY, bib_ctrlno TEXT);""")
+        c.execute("""CREATE TABLE IF NOT EXISTS version
+                     (version INT);""")
+        c.execute("""CREATE TABLE IF NOT EXISTS identifiers (
+                      type TEXT, value TEXT, bib_ctrlno TEXT,
+                      PRIMARY KEY (type, value, bib_ctrlno)
+                     );""")
+        c.execute("""CREATE INDEX IF NOT EXISTS identifiers_bib_ctrlno
+                     ON identifiers (bib_ctrlno);""")
+        # not bothering with FK constraints
+        conn.commit()
 
     def __update_version(self):
         self.cur.execute("DELETE FROM version;")
         self.cur.execute("INSERT OR REPLACE INTO version VALUES (?);",
                           (self.version,))
-        self.conn.commit()
+
+    def __seed_history(self):
+        # existing mirror without a history: record it as the full base
+        self.cur.execute("SELECT 1 FROM records LIMIT 1;")
+        if self.cur.fetchone() is None:
+            return
+        self.cur.execute("SELECT version FROM version LIMIT 1;")
+        result = self.cur.fetchone()
+        base_version = result[0] if result is not None else self.version
+        self.history.seed(base_version, self.conn.execute("SELECT type, ctrlno, record FROM records;"))
 
     def get_version(self):
         self.cur.execute("SELECT version FROM version LIMIT 1;")
         return self.cur.fetchone()[0]
 
-    def __make_backup(self):
-        shutil.copyfile(f"{self.filename}", f"{self.filename}.{self.version}")
+    def make_snapshot(self, filename=None):
+        # online backup api: consistent copy even while other connections write
+        filename = filename or f"{self.filename}.{self.version}"
+        with sqlite3.connect(filename) as backup_conn:
+            self.conn.backup(backup_conn)
+        backup_conn.close()
+        return filename
 
     BIB, AUT, HDG = VoyagerAPI.BIB, VoyagerAPI.AUT, VoyagerAPI.HDG
     def populate(self, record_type, marc_reader):
         # expects pymarc MARCReader
+        assert not self.read_only, "cannot populate in a read-only session"
         add_function = { self.BIB : self.__add_bib,
                          self.AUT : self.__add_aut,
                          self.HDG : self.__add_hdg }.get(record_type)
@@ -93,49 +163,296 @@ class LMLDBSQLite:
             add_function(record)
         self.conn.commit()
 
+    def populate_parallel(self, record_type, marc_file, **ingest_kwargs):
+        # expects binary file object of ISO 2709 records
+        assert not self.read_only, "cannot populate in a read-only session"
+        return ParallelIngest(self, **ingest_kwargs).run(record_type, marc_file)
+
+    def add_encoded_records(self, record_type, rows):
+        # rows of (ctrlno, pickled record, derived columns), see LmlDbIngest
+        assert not self.read_only, "cannot populate in a read-only session"
+        self.cur.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?);",
+                              ((record_type, ctrlno, record_blob) for ctrlno, record_blob, _ in rows))
+        if record_type == self.HDG:
+            self.cur.executemany("INSERT OR REPLACE INTO holdings_links VALUES (?, ?);",
+                                  ((ctrlno, derived['bib_ctrlno']) for ctrlno, _, derived in rows))
+        elif record_type == self.BIB:
+            for ctrlno, _, derived in rows:
+                self.__index_identifiers(ctrlno, derived['identifiers'])
+        if self.use_heading_index and record_type != self.HDG:
+            for ctrlno, _, derived in rows:
+                self.__index_headings(record_type, ctrlno, derived['headings'])
+        for ctrlno, record_blob, derived in rows:
+            if 'compressed_record' in derived:
+                self.history.add_change(self.version, record_type, ctrlno, derived['compressed_record'], compressed=True)
+            else:
+                self.history.add_change(self.version, record_type, ctrlno, record_blob)
+        self.conn.commit()
+
     def __add_bib(self, bib_record):
         bib_record.__class__ = LaneMARCRecord
         ctrlno = bib_record['001'].data
-        self.cur.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?);",
-                          (self.BIB, ctrlno, pickle.dumps(bib_record)))
+        self.__add_record(self.BIB, ctrlno, pickle.dumps(bib_record))
+        self.__index_identifiers(ctrlno, bib_record.get_identifiers())
+        if self.use_heading_index:
+            self.__index_headings(self.BIB, ctrlno, bib_record.get_search_headings())
     def __add_aut(self, aut_record):
         aut_record.__class__ = LaneMARCRecord
         ctrlno = aut_record['001'].data
-        self.cur.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?);",
-                          (self.AUT, ctrlno, pickle.dumps(aut_record)))
+        self.__add_record(self.AUT, ctrlno, pickle.dumps(aut_record))
+        if self.use_heading_index:
+            self.__index_headings(self.AUT, ctrlno, aut_record.get_search_headings())
     def __add_hdg(self, hdg_record):
         hdg_record.__class__ = LaneMARCRecord
         hdg_ctrlno = hdg_record['001'].data
         bib_ctrlno = hdg_record['004'].data
-        self.cur.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?);",
-                          (self.HDG, hdg_ctrlno, pickle.dumps(hdg_record)))
+        self.__add_record(self.HDG, hdg_ctrlno, pickle.dumps(hdg_record))
         self.cur.execute("INSERT OR REPLACE INTO holdings_links VALUES (?, ?);",
                           (hdg_ctrlno, bib_ctrlno))
 
-    def get_records(self, record_type=None, ctrlnos=[]):
+    def __add_record(self, record_type, ctrlno, record_blob):
+        self.cur.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?);",
+                          (record_type, ctrlno, record_blob))
+        self.history.add_change(self.version, record_type, ctrlno, record_blob)
+
+    def __index_identifiers(self, bib_ctrlno, identifiers):
+        self.cur.execute("DELETE FROM identifiers WHERE bib_ctrlno = ?;",
+                          (bib_ctrlno,))
+        self.cur.executemany("INSERT OR REPLACE INTO identifiers VALUES (?, ?, ?);",
+                              ((id_type, value, bib_ctrlno) for id_type, value in identifiers))
+
+    def rebuild_identifier_index(self):
+        # backfill for mirrors populated before the identifiers table existed
+        self.cur.execute("DELETE FROM identifiers;")
+        for ctrlno, bib_record in self.get_bibs():
+            self.__index_identifiers(ctrlno, bib_record.get_identifiers())
+        self.conn.commit()
+
+    def create_heading_index(self):
+        # build full-text heading index from current bibs and auts;
+        #   populate keeps it up to date from then on
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS headings (
+                              id INTEGER PRIMARY KEY, type TEXT, ctrlno TEXT,
+                              element_type TEXT, variant INT, text TEXT
+                            );""")
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS headings_type_ctrlno
+                            ON headings (type, ctrlno);""")
+        # external-content fts table, synced by triggers
+        self.cur.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS headings_fts
+                            USING fts5(text, content='headings', content_rowid='id');""")
+        self.cur.execute("""CREATE TRIGGER IF NOT EXISTS headings_ai AFTER INSERT ON headings BEGIN
+                              INSERT INTO headings_fts (rowid, text) VALUES (new.id, new.text);
+                            END;""")
+        self.cur.execute("""CREATE TRIGGER IF NOT EXISTS headings_ad AFTER DELETE ON headings BEGIN
+                              INSERT INTO headings_fts (headings_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                            END;""")
+        self.cur.execute("DELETE FROM headings;")
+        self.use_heading_index = True
+        for record_type in (self.BIB, self.AUT):
+            for ctrlno, record in self.get_records(record_type):
+                self.__index_headings(record_type, ctrlno, record.get_search_headings())
+        self.conn.commit()
+
+    def __index_headings(self, record_type, ctrlno, headings):
+        self.cur.execute("DELETE FROM headings WHERE type = ? AND ctrlno = ?;",
+                          (record_type, ctrlno))
+        self.cur.executemany("""INSERT INTO headings (type, ctrlno, element_type, variant, text)
+                                VALUES (?, ?, ?, ?, ?);""",
+                              ((record_type, ctrlno, element_type, int(variant), text)
+                               for element_type, variant, text in headings))
+
+    def search_headings(self, query, record_type=None, element_types=(), prefix=True, limit=100):
+        """
+        Returns ranked list of (type, ctrlno, element_type, matched text, is variant),
+        best match per record, for headings containing all words of query.
+        With prefix, the last word may be partial.
+        """
+        assert self.use_heading_index, "no heading index (see create_heading_index)"
+        words = LaneMARCRecord.normalize(query).split()
+        if not words:
+            return []
+        fts_query = ' '.join(f'"{word}"' for word in words)
+        if prefix:
+            fts_query += '*'
+        sql = """SELECT headings.type, headings.ctrlno, headings.element_type, headings.text, headings.variant,
+                        min(headings_fts.rank) AS best
+                 FROM headings_fts JOIN headings ON headings.id = headings_fts.rowid
+                 WHERE headings_fts MATCH ?"""
+        params = (fts_query,)
+        if record_type is not None:
+            sql += " AND headings.type = ?"
+            params += (record_type,)
+        if element_types:
+            sql += f" AND headings.element_type IN ({','.join('?'*len(element_types))})"
+            params += (*element_types,)
+        sql += " GROUP BY headings.type, headings.ctrlno ORDER BY best LIMIT ?"
+        params += (limit,)
+        self.cur.execute(sql, params)
+        return [(record_type, ctrlno, element_type, text, bool(variant))
+                for record_type, ctrlno, element_type, text, variant, _ in self.cur.fetchall()]
+
+    def delete_records(self, record_type, ctrlnos):
+        assert not self.read_only, "cannot delete in a read-only session"
+        for ctrlno in ctrlnos:
+            self.cur.execute("DELETE FROM records WHERE type = ? AND ctrlno = ?;",
+                              (record_type, ctrlno))
+            if record_type == self.HDG:
+                self.cur.execute("DELETE FROM holdings_links WHERE hdg_ctrlno = ?;",
+                                  (ctrlno,))
+            elif record_type == self.BIB:
+                self.__index_identifiers(ctrlno, ())
+            if self.use_heading_index:
+                self.__index_headings(record_type, ctrlno, ())
+            self.history.add_change(self.version, record_type, ctrlno, None)
+        self.conn.commit()
+
+    def get_records(self, record_type=None, ctrlnos=[], order='ctrlno'):
+        # order: 'ctrlno', or 'input' to follow the order of ctrlnos
+        for ctrlno, record_blob in self.get_raw_records(record_type, ctrlnos, order):
+            yield ctrlno, pickle.loads(record_blob)
+
+    def get_ctrlno_ranges(self, record_type, n):
+        # (lo, hi) of up to n contiguous ctrlno ranges of record_type, of about equal record counts
+        self.cur.execute("""SELECT min(ctrlno), max(ctrlno) FROM
+                              (SELECT CAST(ctrlno AS INTEGER) AS ctrlno,
+                                      ntile(?) OVER (ORDER BY CAST(ctrlno AS INTEGER)) AS shard
+                               FROM records WHERE type = ?)
+                            GROUP BY shard ORDER BY shard;""",
+                          (n, record_type))
+        return self.cur.fetchall()
+
+    # above this many, ctrlnos/values are loaded into a temp table and joined
+    #   rather than expanded into an IN list (bound parameter limit, planning)
+    LARGE_CTRLNO_SET = 1000
+    def get_raw_records(self, record_type=None, ctrlnos=[], order='ctrlno', ctrlno_range=None):
+        # as get_records, but without unpickling; ctrlno_range: only (lo, hi) inclusive
         assert record_type in (None, self.BIB, self.AUT, self.HDG), \
             f"invalid record type: {record_type}"
-        query = "SELECT ctrlno, record FROM records"
+        assert order in ('ctrlno', 'input'), f"invalid order: {order}"
+        ctrlnos = list(dict.fromkeys(str(ctrlno) for ctrlno in ctrlnos))
+        query = "SELECT records.ctrlno, records.record FROM records"
         query_where = []
         params = ()
+        order_by = "CAST(records.ctrlno AS INTEGER)"
+        value_set = None
+        if len(ctrlnos) > self.LARGE_CTRLNO_SET:
+            value_set = self.__create_value_set(ctrlnos)
+            query += f" JOIN {value_set} ON {value_set}.value = records.ctrlno"
+            if order == 'input':
+                order_by = f"{value_set}.position"
+        elif ctrlnos:
+            query_where.append(f"records.ctrlno IN ({','.join('?'*len(ctrlnos))})")
+            params += (*ctrlnos,)
         if record_type is not None:
-            query_where.append("type = ?")
+            query_where.append("records.type = ?")
             params += (record_type,)
-        if ctrlnos:
-            query_where.append(f"ctrlno IN ({','.join('?'*len(ctrlnos))})")
-            params += (*ctrlnos,)
+        if ctrlno_range is not None:
+            query_where.append("CAST(records.ctrlno AS INTEGER) BETWEEN ? AND ?")
+            params += (*ctrlno_range,)
         if query_where:
             query += " WHERE " + " AND ".join(query_where)
-        self.cur.execute(query, params)
-        for ctrlno, record_blob in self.cur.fetchall():
-            yield ctrlno, pickle.loads(record_blob)
+        query += f" ORDER BY {order_by}"
+        # separate cursor, so lookups on self.cur can be interleaved
+        cur = self.conn.cursor()
+        try:
+            cur.execute(query, params)
+            if ctrlnos and value_set is None and order == 'input':
+                # small set: just reorder in memory
+                position = {ctrlno: i for i, ctrlno in enumerate(ctrlnos)}
+                yield from sorted(cur.fetchall(), key=lambda result: position[result[0]])
+            else:
+                yield from cur
+        finally:
+            cur.close()
+            if value_set is not None:
+                self.__release_value_set(value_set)
+
+    def __create_value_set(self, values):
+        # one temp table per open query, so concurrent generators don't collide;
+        #   emptied and reused afterwards (cannot be dropped while other statements are pending)
+        in_transaction = self.conn.in_transaction
+        if self.value_sets_free:
+            value_set = self.value_sets_free.pop()
+        else:
+            value_set = f"temp.value_set_{len(self.value_sets)}"
+            self.value_sets.append(value_set)
+        # a write session's rollback may have undone the table's creation or emptying
+        self.conn.execute(f"""CREATE TEMP TABLE IF NOT EXISTS {value_set}
+                              (value TEXT PRIMARY KEY, position INT);""")
+        self.conn.execute(f"DELETE FROM {value_set};")
+        self.conn.executemany(f"INSERT OR IGNORE INTO {value_set} VALUES (?, ?);",
+                               ((value, i) for i, value in enumerate(values)))
+        self.__end_value_set_transaction(in_transaction)
+        return value_set
+
+    def __release_value_set(self, value_set):
+        in_transaction = self.conn.in_transaction
+        self.conn.execute(f"DELETE FROM {value_set};")
+        self.value_sets_free.append(value_set)
+        self.__end_value_set_transaction(in_transaction)
 
-    def get_bibs(self, ctrlnos=[]):
-        return self.get_records(self.BIB, ctrlnos)
-    def get_auts(self, ctrlnos=[]):
-        return self.get_records(self.AUT, ctrlnos)
-    def get_hdgs(self, ctrlnos=[]):
-        return self.get_records(self.HDG, ctrlnos)
+    def __end_value_set_transaction(self, in_transaction):
+        # temp table DML opens an implicit transaction; left open, the reads that follow
+        #   would hold a shared lock on lml.db and writers would get "database is locked".
+        #   a write session's own pending changes are left for it to commit
+        if not in_transaction:
+            self.conn.commit()
+
+    def get_bibs(self, ctrlnos=[], order='ctrlno'):
+        return self.get_records(self.BIB, ctrlnos, order)
+    def get_auts(self, ctrlnos=[], order='ctrlno'):
+        return self.get_records(self.AUT, ctrlnos, order)
+    def get_hdgs(self, ctrlnos=[], order='ctrlno'):
+        return self.get_records(self.HDG, ctrlnos, order)
+
+    ISBN, ISSN = LaneMARCRecord.ISBN, LaneMARCRecord.ISSN
+    def get_bibs_for_identifiers(self, id_type, values):
+        # returns dict of normalized value -> list of bib ctrlnos, in one query
+        normalize = { self.ISBN : LaneMARCRecord.normalize_isbn,
+                      self.ISSN : LaneMARCRecord.normalize_issn }.get(id_type)
+        if normalize is None:
+            raise ValueError(f'invalid id_type: {id_type}')
+        values = {normalize(value) for value in values} - {None}
+        if not values:
+            return {}
+        value_set = self.__create_value_set(values) if len(values) > self.LARGE_CTRLNO_SET else None
+        try:
+            if value_set is not None:
+                self.cur.execute(f"""SELECT identifiers.value, bib_ctrlno FROM identifiers
+                                     JOIN {value_set} ON {value_set}.value = identifiers.value
+                                     WHERE type = ?
+                                     ORDER BY identifiers.value, bib_ctrlno""",
+                                  (id_type,))
+            else:
+                self.cur.execute(f"""SELECT value, bib_ctrlno FROM identifiers
+                                     WHERE type = ? AND value IN ({','.join('?'*len(values))})
+                                     ORDER BY value, bib_ctrlno""",
+                                  (id_type, *values))
+            results = {}
+            for value, bib_ctrlno in self.cur.fetchall():
+                results.setdefault(value, []).append(bib_ctrlno)
+        finally:
+            if value_set is not None:
+                self.__release_value_set(value_set)
+        return results
+
+    def get_bibs_for_isbns(self, isbns):
+        return self.get_bibs_for_identifiers(self.ISBN, isbns)
+    def get_bibs_for_issns(self, issns):
+        return self.get_bibs_for_identifiers(self.ISSN, issns)
+
+    def get_identifier_clusters(self, id_type=None, min_size=2):
+        # list of (type, value, [bib ctrlnos]) for identifiers shared by >= min_size bibs
+        query = "SELECT type, value, group_concat(bib_ctrlno) FROM identifiers"
+        params = ()
+        if id_type is not None:
+            query += " WHERE type = ?"
+            params += (id_type,)
+        query += " GROUP BY type, value HAVING count(*) >= ? ORDER BY type, value"
+        params += (min_size,)
+        self.cur.execute(query, params)
+        # group_concat order is undefined
+        return [(id_type, value, sorted(bib_ctrlnos.split(','), key=int)) for id_type, value, bib_ctrlnos in self.cur.fetchall()]
 
     def get_bibs_for_hdg(self, hdg_ctrlno):
         hdg_ctrlno = re.sub(r'\D', '', hdg_ctrlno)
@@ -150,3 +467,13 @@ class LMLDBSQLite:
                             WHERE bib_ctrlno = ?""",
                             (bib_ctrlno,))
         return [result[0] for result in self.cur.fetchall()]
+
+    bib_to_hdg_map, hdg_to_bib_map = None, None
+    def fetch_and_cache_bib_hdg_maps(self):
+        self.bib_to_hdg_map, self.hdg_to_bib_map = {}, {}
+        self.cur.execute("SELECT hdg_ctrlno, bib_ctrlno FROM holdings_links;")
+        for hdg_ctrlno, bib_ctrlno in self.cur.fetchall():
+            self.hdg_to_bib_map[hdg_ctrlno] = [bib_ctrlno]
+            if bib_ctrlno not in self.bib_to_hdg_map:
+                self.bib_to_hdg_map[bib_ctrlno] = []
+            self.bib_to_hdg_map[bib_ctrlno].append(hdg_ctrlno)
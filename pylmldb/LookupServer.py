@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""
+read-only local lookup service over an lmldb mirror:
+minimal asyncio HTTP/1.1 (TCP or unix socket), JSON responses
+
+GET /record/{type}/{ctrlno}
+GET /records/{type}?ctrlnos=1,2,3
+GET /control-number/{prefixed control number}     e.g. (CStL)L12345
+GET /hdgs-for-bib/{bib ctrlno}[?records=1]
+GET /bibs-for-hdg/{hdg ctrlno}[?records=1]
+GET /metrics
+"""
+
+import argparse, asyncio, json, re, time
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from loguru import logger
+
+from .VoyagerAPI import VoyagerAPI
+
+
+class LookupRequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LMLDBLookupServer:
+    """
+    Read-only lookup server with a bounded LRU cache of decoded records
+
+    The cache and bib/holdings link maps are dropped and rebuilt
+    whenever the mirror's version advances (checked at most every
+    version_check_interval seconds, on request).
+    """
+    BIB, AUT, HDG = VoyagerAPI.BIB, VoyagerAPI.AUT, VoyagerAPI.HDG
+    STATUS_TEXT = { 200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                    405: 'Method Not Allowed', 500: 'Internal Server Error' }
+
+    def __init__(self, db, cache_size: int=10000, version_check_interval: float=30) -> None:
+        # expects read-only LMLDB/LMLDBSQLite
+        self.db = db
+        self.cache_size = cache_size
+        self.version_check_interval = version_check_interval
+        self.cache = OrderedDict()
+        self.version, self.version_checked = None, None
+        self.metrics = { 'requests': 0, 'errors': 0,
+                         'cache_hits': 0, 'cache_misses': 0,
+                         'invalidations': 0,
+                         'latency_total_ms': 0.0, 'latency_max_ms': 0.0 }
+        self.__check_version()
+
+    # ~~~~~~ CACHE ~~~~~~
+
+    def __check_version(self) -> None:
+        now = time.monotonic()
+        if self.version_checked is not None and now - self.version_checked < self.version_check_interval:
+            return
+        first_check = self.version_checked is None
+        self.version_checked = now
+        try:
+            version = self.db.get_version()
+        except Exception as e:
+            # keep serving what's cached; retried after the interval like any other check
+            logger.warning(f"version check failed: {e}")
+            version = self.version
+        if first_check or version != self.version:
+            if not first_check:
+                logger.info(f"version {self.version} -> {version}, invalidating cache")
+                self.metrics['invalidations'] += 1
+            self.version = version
+            self.cache.clear()
+            self.db.fetch_and_cache_bib_hdg_maps()
+
+    def get_records(self, record_type, ctrlnos) -> dict:
+        """ctrlno -> decoded record, for those that exist"""
+        ctrlnos = [str(ctrlno) for ctrlno in ctrlnos]
+        records, misses = {}, []
+        for ctrlno in ctrlnos:
+            record = self.cache.get((record_type, ctrlno))
+            if record is None:
+                misses.append(ctrlno)
+            else:
+                self.cache.move_to_end((record_type, ctrlno))
+                records[ctrlno] = record
+        self.metrics['cache_hits'] += len(records)
+        self.metrics['cache_misses'] += len(misses)
+        if misses:
+            for ctrlno, record in self.db.get_records(record_type, misses):
+                ctrlno = str(ctrlno)
+                records[ctrlno] = record
+                self.cache[(record_type, ctrlno)] = record
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return records
+
+    # ~~~~~~ ENDPOINTS ~~~~~~
+
+    def lookup(self, path: str, params: dict):
+        self.__check_version()
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if parts == ['metrics']:
+            return dict(self.metrics, cache_size=len(self.cache), version=self.version)
+        elif len(parts) == 3 and parts[0] == 'record':
+            record_type, ctrlno = self.__check_record_type(parts[1]), self.__check_ctrlno(parts[2])
+            record = self.get_records(record_type, [ctrlno]).get(ctrlno)
+            if record is None:
+                raise LookupRequestError(404, f"no such record: {record_type} {ctrlno}")
+            return record.as_dict()
+        elif len(parts) == 2 and parts[0] == 'records':
+            record_type = self.__check_record_type(parts[1])
+            ctrlnos = [self.__check_ctrlno(ctrlno) for value in params.get('ctrlnos', []) for ctrlno in value.split(',') if ctrlno]
+            records = self.get_records(record_type, ctrlnos)
+            return { ctrlno: (records[ctrlno].as_dict() if ctrlno in records else None) for ctrlno in ctrlnos }
+        elif len(parts) == 2 and parts[0] == 'control-number':
+            return self.__lookup_control_number(parts[1]).as_dict()
+        elif len(parts) == 2 and parts[0] in ('hdgs-for-bib', 'bibs-for-hdg'):
+            if parts[0] == 'hdgs-for-bib':
+                linked_record_type, linked_ctrlnos = self.HDG, self.db.bib_to_hdg_map.get(parts[1], [])
+            else:
+                linked_record_type, linked_ctrlnos = self.BIB, self.db.hdg_to_bib_map.get(parts[1], [])
+            if params.get('records', ['0'])[0] in ('0', ''):
+                return linked_ctrlnos
+            records = self.get_records(linked_record_type, linked_ctrlnos)
+            return { ctrlno: (records[ctrlno].as_dict() if ctrlno in records else None) for ctrlno in linked_ctrlnos }
+        raise LookupRequestError(404, f"unknown endpoint: {path}")
+
+    def __check_record_type(self, record_type):
+        if record_type not in (self.BIB, self.AUT, self.HDG):
+            raise LookupRequestError(400, f"invalid record type: {record_type}")
+        return record_type
+
+    CTRLNO_RE = re.compile(r'[0-9]+')
+    def __check_ctrlno(self, ctrlno):
+        if self.CTRLNO_RE.fullmatch(ctrlno) is None:
+            raise LookupRequestError(400, f"invalid ctrlno: {ctrlno}")
+        return ctrlno
+
+    PREFIXED_CONTROL_NUMBER_RE = re.compile(r'^(?:\(CStL\))?([A-Z])(\d+)$')
+    def __lookup_control_number(self, prefixed_ctrlno):
+        match = self.PREFIXED_CONTROL_NUMBER_RE.match(prefixed_ctrlno)
+        if match is None:
+            raise LookupRequestError(400, f"invalid control number: {prefixed_ctrlno}")
+        letter, ctrlno = match.groups()
+        record_type = self.BIB if letter in 'LQ' else self.HDG if letter == 'H' else self.AUT
+        record = self.get_records(record_type, [ctrlno]).get(ctrlno)
+        # letter must agree with the record's own control number
+        if record is None or record.get_control_number() != f"(CStL){letter}{ctrlno}":
+            raise LookupRequestError(404, f"no such record: {prefixed_ctrlno}")
+        return record
+
+    # ~~~~~~ HTTP ~~~~~~
+
+    async def handle_connection(self, reader, writer) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                status, body = self.__respond(request_line.decode('latin-1').split())
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f"HTTP/1.1 {status} {self.STATUS_TEXT[status]}\r\n"
+                             f"Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(body)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def __respond(self, request):
+        start = time.perf_counter()
+        self.metrics['requests'] += 1
+        try:
+            if len(request) != 3:
+                raise LookupRequestError(400, "malformed request")
+            method, target, _ = request
+            if method != 'GET':
+                raise LookupRequestError(405, f"method not allowed: {method}")
+            url = urlsplit(target)
+            status, result = 200, self.lookup(url.path, parse_qs(url.query))
+        except LookupRequestError as e:
+            status, result = e.status, {'error': str(e)}
+        except Exception as e:
+            logger.exception(e)
+            status, result = 500, {'error': str(e)}
+        if status != 200:
+            self.metrics['errors'] += 1
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.metrics['latency_total_ms'] += latency_ms
+        self.metrics['latency_max_ms'] = max(self.metrics['latency_max_ms'], latency_ms)
+        return status, json.dumps(result, ensure_ascii=False).encode('utf-8')
+
+    async def serve(self, host: str='127.0.0.1', port: int=8080, unix_socket: str=None) -> None:
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            logger.info(f"serving on {unix_socket}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            logger.info(f"serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="read-only lmldb lookup server")
+    parser.add_argument('--sqlite', action='store_true', help="use local sqlite mirror (lml.db)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix-socket', default=None)
+    parser.add_argument('--cache-size', type=int, default=10000)
+    parser.add_argument('--version-check-interval', type=float, default=30)
+    args = parser.parse_args()
+    if args.sqlite:
+        from .LmlDbSQLite import LMLDBSQLite
+        db = LMLDBSQLite()
+    else:
+        from .LmlDb import LMLDB
+        db = LMLDB(cache_bibmfhd_links=True)
+    with db:
+        server = LMLDBLookupServer(db, args.cache_size, args.version_check_interval)
+        asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+
+
+if __name__ == "__main__":
+    main()
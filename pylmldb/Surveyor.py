@@ -5,23 +5,32 @@
 abstract surveyor (marc catalog based report-generating) architecture for lmldb
 """
 
-import csv
+import csv, functools, hashlib, pickle, types
+from contextlib import ExitStack
 
 from loguru import logger
 
 from .LmlDb import LMLDB
+from .SurveyorCache import SurveyorCache
+from .SurveyorWriters import get_writer
 
 
 class Surveyor:
     """
     Abstracted marc lmldb report generator
+
+    Filters and columns are called as f(primary_id, primary_record,
+    secondary_records, tertiary_records) and must not modify the records:
+    in a SurveyorBatch the same decoded records are passed to every report.
     """
     BIB, AUT, HDG = LMLDB.BIB, LMLDB.AUT, LMLDB.HDG
     def __init__(self, primary_record_type: str,
                        filters: list=[],
                        columns: dict={'id':(lambda c,p,s,t: c)},
                        use_crossreferencing: bool=False,
-                       use_items: bool=False) -> None:
+                       use_items: bool=False,
+                       report_version: str=None,
+                       column_types: dict=None) -> None:
         assert primary_record_type in (self.BIB, self.AUT, self.HDG), \
             f"invalid primary_record_type: {primary_record_type} (must be in: ({self.BIB}, {self.AUT}, {self.HDG}))"
         self.primary_record_type = primary_record_type
@@ -29,6 +38,9 @@ class Surveyor:
         self.columns = columns
         self.use_crossreferencing = use_crossreferencing
         self.use_items = use_items
+        self.report_version = report_version
+        # optional column title -> type for typed output (see SurveyorWriters.ParquetWriter)
+        self.column_types = column_types
 
     def set_filters(self, filters: list) -> None:
         self.filters = filters
@@ -42,60 +54,190 @@ class Surveyor:
     def add_column(self, title, f) -> None:
         self.columns[title] = f
 
-    def run_report(self, outf_name: str="surveyor_out.csv") -> None:
-        # check write permissions for output file before running the whole thing
-        with open(outf_name, 'w', encoding='utf-8-sig') as outf:
-            pass
+    def get_fingerprint(self) -> str:
+        """
+        Hash of the report definition (record type, options, column titles,
+        and the code, defaults and closed-over values of each filter/column
+        function), used to key cached results.
+        Functions called by name from within filters/columns are not included;
+        clear the cache when those change.
+        If report_version is set, it is used in place of the functions' code;
+        it is required for filters/columns that can't be fingerprinted
+        (e.g. closures over arbitrary objects).
+        """
+        h = hashlib.sha1(repr((self.primary_record_type,
+                               self.use_crossreferencing,
+                               self.use_items,
+                               tuple(self.columns.keys()),
+                               self.report_version)).encode())
+        if self.report_version is None:
+            for f in list(self.filters) + list(self.columns.values()):
+                h.update(self.__get_value_fingerprint(f, set()))
+        return h.hexdigest()
+
+    @classmethod
+    def __get_value_fingerprint(cls, value, seen) -> bytes:
+        # must not depend on addresses or hash seeds, so same report = same fingerprint in any process
+        if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+            return repr(value).encode()
+        elif isinstance(value, (tuple, list)):
+            return b'(' + b'\x01'.join(cls.__get_value_fingerprint(v, seen) for v in value) + b')'
+        elif isinstance(value, (set, frozenset)):
+            return b'{' + b'\x01'.join(sorted(cls.__get_value_fingerprint(v, seen) for v in value)) + b'}'
+        elif isinstance(value, dict):
+            return b'{' + b'\x01'.join(sorted(cls.__get_value_fingerprint(k, seen) + b':' + cls.__get_value_fingerprint(v, seen)
+                                              for k, v in value.items())) + b'}'
+        elif isinstance(value, types.CodeType):
+            return cls.__get_code_fingerprint(value, seen)
+        elif isinstance(value, types.FunctionType):
+            if id(value) in seen:
+                return b'<recursive>'
+            seen.add(id(value))
+            return b'\x00'.join((cls.__get_code_fingerprint(value.__code__, seen),
+                                  cls.__get_value_fingerprint(value.__defaults__, seen),
+                                  cls.__get_value_fingerprint(value.__kwdefaults__, seen),
+                                  cls.__get_value_fingerprint([cell.cell_contents for cell in (value.__closure__ or ())], seen)))
+        elif isinstance(value, types.MethodType):
+            return cls.__get_value_fingerprint((value.__func__, value.__self__), seen)
+        elif isinstance(value, functools.partial):
+            return cls.__get_value_fingerprint((value.func, value.args, value.keywords), seen)
+        elif isinstance(value, (types.BuiltinFunctionType, type)):
+            return f"{value.__module__}.{value.__qualname__}".encode()
+        raise ValueError(f"cannot fingerprint {type(value).__name__} {value!r}: set report_version instead")
+
+    @classmethod
+    def __get_code_fingerprint(cls, code, seen) -> bytes:
+        # repr of nested code objects includes their address, so recurse instead
+        return b'\x00'.join([code.co_code, repr(code.co_names).encode()] +
+                             [cls.__get_value_fingerprint(const, seen) for const in code.co_consts])
+
+    def evaluate(self, primary_id, primary_record, secondary_records, tertiary_records):
+        """
+        Returns list of column values if record set passes all filters, otherwise None.
+        """
+        record_set = (primary_id, primary_record, secondary_records, tertiary_records)
+        if not all(f(*record_set) for f in self.filters):
+            return None
+        return [col_func(*record_set) for col_func in self.columns.values()]
+
+    def run_report(self, outf_name: str="surveyor_out.csv", cache_filename: str=None, output_format: str=None) -> None:
+        """
+        Output format (csv, jsonl, parquet; optionally .gz/.zst compressed)
+        is taken from outf_name's extension unless output_format is given;
+        csv by default (see SurveyorWriters).
+        If cache_filename is given, per-record results are stored there and
+        reused on later runs for records (and their linked secondary records)
+        that are unchanged.
+        """
+        SurveyorBatch([(self, outf_name, cache_filename, output_format)]).run()
+
+
+class SurveyorBatch:
+    """
+    Runs several Surveyor reports in a single pass: each record type is
+    scanned and decoded once and crossreferences are built once, then every
+    report's filters and columns are evaluated per record and streamed to
+    its own output file.
+
+    Each record is decoded once and shared by all reports, so filters and
+    columns must treat records as read-only (copy.deepcopy one first if
+    it needs modifying); otherwise the change leaks into later reports.
+    """
+    BIB, AUT, HDG = LMLDB.BIB, LMLDB.AUT, LMLDB.HDG
+    def __init__(self, reports: list=[]) -> None:
+        # list of (surveyor, outf_name, cache_filename, output_format)
+        self.reports = []
+        for report in reports:
+            self.add_report(*report)
+
+    def add_report(self, surveyor: Surveyor, outf_name: str, cache_filename: str=None, output_format: str=None) -> None:
+        self.reports.append((surveyor, outf_name, cache_filename, output_format))
+
+    def run(self) -> None:
+        # check write permissions for output files before running the whole thing
+        for _, outf_name, _, _ in self.reports:
+            with open(outf_name, 'w') as outf:
+                pass
         #
         with LMLDB() as db:
-            primary_id_to_secondary_records = {}
-            secondary_id_to_secondary_record = {}
-            if self.use_crossreferencing and self.primary_record_type != db.AUT:
-                logger.info("building crossreferences")
-                if self.primary_record_type == db.HDG:
-                    secondary_record_type, get_secondary_record_ids = db.BIB, db.get_bibs_for_hdg
-                else:
-                    secondary_record_type, get_secondary_record_ids = db.HDG, db.get_hdgs_for_bib
+            secondary_blobs_by_type = {}
+            for primary_record_type in (self.BIB, self.AUT, self.HDG):
+                reports = [report for report in self.reports if report[0].primary_record_type == primary_record_type]
+                if reports:
+                    self.__run_primary_record_type(db, primary_record_type, reports, secondary_blobs_by_type)
+
+    def __run_primary_record_type(self, db, primary_record_type, reports, secondary_blobs_by_type) -> None:
+        use_crossreferencing = primary_record_type != db.AUT and \
+                               any(surveyor.use_crossreferencing for surveyor, _, _, _ in reports)
+        secondary_id_to_secondary_blob = {}
+        get_secondary_record_ids = lambda primary_id: ()
+        if use_crossreferencing:
+            logger.info("building crossreferences")
+            if primary_record_type == db.HDG:
+                secondary_record_type, get_secondary_record_ids = db.BIB, db.get_bibs_for_hdg
+            else:
+                secondary_record_type, get_secondary_record_ids = db.HDG, db.get_hdgs_for_bib
+            if secondary_record_type not in secondary_blobs_by_type:
                 logger.info("mapping secondary record ids to secondary records")
-                for ctrlno, record in db.get_records(secondary_record_type):
-                    secondary_id_to_secondary_record[str(ctrlno)] = record
-                logger.info("mapping primary record ids to lists of secondary records")
-                for ctrlno, record in db.get_records(self.primary_record_type):
-                    primary_id = str(ctrlno)
-                    primary_id_to_secondary_records[primary_id] = [secondary_id_to_secondary_record.get(secondary_id) for secondary_id in (get_secondary_record_ids(primary_id) or ())]
-                del secondary_id_to_secondary_record
-                if self.use_items:
-                    # load item vw table
-                    # @@@@@@@@@@@@@@@@@@@@@@@@@
-                    logger.info("pull item record info")
-                    with open("surveyordata/ITEM_VW.csv", encoding='windows-1251') as inf:
-                        reader = csv.reader(inf, dialect='excel')
-                        header = list(next(reader))
-                        item_vw = [dict(zip(header,line)) for line in reader]
-
-            # pull records and filter
-            logger.info("pull primary records and filter")
-            filtered_record_sets = []
-            for ctrlno, primary_record in db.get_records(self.primary_record_type):
+                # kept encoded; decoded on first use
+                secondary_blobs_by_type[secondary_record_type] = {str(ctrlno): record_blob for ctrlno, record_blob in db.get_raw_records(secondary_record_type)}
+            secondary_id_to_secondary_blob = secondary_blobs_by_type[secondary_record_type]
+            if any(surveyor.use_items for surveyor, _, _, _ in reports):
+                # load item vw table
+                # @@@@@@@@@@@@@@@@@@@@@@@@@
+                logger.info("pull item record info")
+                with open("surveyordata/ITEM_VW.csv", encoding='windows-1251') as inf:
+                    reader = csv.reader(inf, dialect='excel')
+                    header = list(next(reader))
+                    item_vw = [dict(zip(header,line)) for line in reader]
+        secondary_id_to_secondary_record = {}
+        def get_secondary_record(secondary_id):
+            if secondary_id not in secondary_id_to_secondary_record:
+                record_blob = secondary_id_to_secondary_blob.get(secondary_id)
+                secondary_id_to_secondary_record[secondary_id] = pickle.loads(record_blob) if record_blob is not None else None
+            return secondary_id_to_secondary_record[secondary_id]
+
+        with ExitStack() as stack:
+            # per report: surveyor, output writer, cache
+            runs = []
+            for surveyor, outf_name, cache_filename, output_format in reports:
+                writer = stack.enter_context(get_writer(outf_name, surveyor.columns.keys(), output_format,
+                                                        column_types=surveyor.column_types))
+                cache = SurveyorCache(cache_filename, surveyor.get_fingerprint()) if cache_filename else None
+                if cache is not None:
+                    stack.enter_context(cache)
+                runs.append((surveyor, writer, cache))
+
+            # pull records, filter and build columns
+            logger.info(f"pull {primary_record_type} records, filter and output for {len(runs)} report(s)")
+            for ctrlno, primary_blob in db.get_raw_records(primary_record_type):
                 primary_id = str(ctrlno)
-                secondary_records = primary_id_to_secondary_records.get(primary_id, [])
-                tertiary_records = []
-                if all(f(primary_id, primary_record, secondary_records, tertiary_records) for f in self.filters):
-                    filtered_record_sets.append((primary_id, primary_record, secondary_records, tertiary_records))
-
-        # build columns
-        # header
-        results = [tuple(self.columns.keys())]
-        for record_set in filtered_record_sets:
-            results.append([col_func(*record_set) for col_func in self.columns.values()])
-
-        # output
-        logger.info("outputting")
-        with open(outf_name, 'w', encoding='utf-8-sig') as outf:
-            writer = csv.writer(outf, dialect=csv.excel, quoting=csv.QUOTE_ALL)
-            for result in results:
-                writer.writerow(result)
-
+                secondary_ids = (get_secondary_record_ids(primary_id) or ()) if use_crossreferencing else ()
+                primary_record, secondary_records, content_hashes = None, None, {}
+                for surveyor, writer, cache in runs:
+                    report_secondary_ids = secondary_ids if surveyor.use_crossreferencing else ()
+                    if cache is not None:
+                        crossreferenced = bool(report_secondary_ids)
+                        if crossreferenced not in content_hashes:
+                            content_hashes[crossreferenced] = cache.get_content_hash(primary_blob, [secondary_id_to_secondary_blob.get(secondary_id) for secondary_id in report_secondary_ids])
+                        content_hash = content_hashes[crossreferenced]
+                        cached = cache.get(primary_id, content_hash)
+                        if cached is not None:
+                            passed, row = cached
+                            if passed:
+                                writer.write_row(row)
+                            continue
+                    # shared by every report in the batch (see class docstring)
+                    if primary_record is None:
+                        primary_record = pickle.loads(primary_blob)
+                    if report_secondary_ids and secondary_records is None:
+                        secondary_records = [get_secondary_record(secondary_id) for secondary_id in secondary_ids]
+                    row = surveyor.evaluate(primary_id, primary_record,
+                                            list(secondary_records) if report_secondary_ids else [], [])
+                    if row is not None:
+                        writer.write_row(row)
+                    if cache is not None:
+                        cache.put(primary_id, content_hash, row is not None, row)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""
+incremental result cache for surveyor reports
+"""
+
+import hashlib, pickle, sqlite3
+
+from loguru import logger
+
+
+class SurveyorCache:
+    """
+    Per-record surveyor results, stored in a (local) sqlite file
+
+    results:
+    | fingerprint [report definition] | ctrlno | content_hash | passed [filters] | row [pickled column values] |
+
+    A cached result is reused only when both the report fingerprint and the
+    content hash (primary record plus linked secondary records) match.
+    """
+    def __init__(self, filename: str, fingerprint: str) -> None:
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.conn = sqlite3.connect(self.filename)
+        self.cur = self.conn.cursor()
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS results (
+                              fingerprint TEXT, ctrlno TEXT, content_hash TEXT,
+                              passed INT, row BLOB,
+                              PRIMARY KEY (fingerprint, ctrlno)
+                            );""")
+        self.conn.commit()
+        self.cur.execute("""SELECT ctrlno, content_hash, passed, row FROM results
+                            WHERE fingerprint = ?;""",
+                          (self.fingerprint,))
+        self.cached = {ctrlno: (content_hash, passed, row) for ctrlno, content_hash, passed, row in self.cur}
+        self.updates, self.seen = [], set()
+        self.hits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.save()
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    @staticmethod
+    def get_content_hash(primary_blob: bytes, secondary_blobs: list) -> str:
+        h = hashlib.sha1(primary_blob)
+        for secondary_blob in secondary_blobs:
+            # fixed-length digests keep [ab, c] and [a, bc] apart
+            h.update(hashlib.sha1(secondary_blob or b'').digest())
+        return h.hexdigest()
+
+    def get(self, ctrlno: str, content_hash: str):
+        """
+        Returns (passed, row) if cached result is current, otherwise None.
+        """
+        self.seen.add(ctrlno)
+        cached = self.cached.get(ctrlno)
+        if cached is None or cached[0] != content_hash:
+            return None
+        self.hits += 1
+        _, passed, row = cached
+        return bool(passed), (pickle.loads(row) if row is not None else None)
+
+    def put(self, ctrlno: str, content_hash: str, passed: bool, row) -> None:
+        self.seen.add(ctrlno)
+        self.updates.append((self.fingerprint, ctrlno, content_hash, int(passed),
+                             pickle.dumps(row) if row is not None else None))
+
+    def save(self) -> None:
+        stale = [(self.fingerprint, ctrlno) for ctrlno in self.cached if ctrlno not in self.seen]
+        logger.info(f"cache: {self.hits} reused, {len(self.updates)} recomputed, {len(stale)} dropped")
+        self.cur.executemany("DELETE FROM results WHERE fingerprint = ? AND ctrlno = ?;", stale)
+        self.cur.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?);", self.updates)
+        self.conn.commit()
+        self.updates = []
@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""
+pluggable surveyor report output writers:
+rows are buffered and written in batches (parquet: one row group per batch)
+"""
+
+import csv, gzip, io, json, os
+
+
+CSV, JSONL, PARQUET = 'csv', 'jsonl', 'parquet'
+GZIP, ZSTD = 'gz', 'zst'
+
+def infer_output_format(outf_name: str) -> tuple:
+    """
+    Returns (format, compression) from an output filename,
+    e.g. report.csv.gz -> (csv, gz); defaults to uncompressed csv.
+    """
+    parts = outf_name.lower().split('.')
+    compression = parts.pop() if len(parts) > 1 and parts[-1] in (GZIP, ZSTD) else None
+    output_format = parts[-1] if len(parts) > 1 and parts[-1] in (CSV, JSONL, PARQUET) else CSV
+    return output_format, compression
+
+
+def open_binary(outf_name: str, compression: str=None):
+    if compression is None:
+        return open(outf_name, 'wb')
+    elif compression == GZIP:
+        return gzip.open(outf_name, 'wb')
+    elif compression == ZSTD:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd output requires the zstandard package")
+        return zstandard.ZstdCompressor().stream_writer(open(outf_name, 'wb'), closefd=True)
+    raise ValueError(f"invalid compression: {compression}")
+
+
+class SurveyorWriter:
+    """
+    Base report writer: buffers rows, flushes every batch_size rows
+    """
+    def __init__(self, outf_name: str, column_names: list, compression: str=None, batch_size: int=10000) -> None:
+        self.outf_name = outf_name
+        self.column_names = list(column_names)
+        self.compression = compression
+        self.batch_size = batch_size
+        self.batch = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def write_row(self, row) -> None:
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+            self.batch = []
+
+    def flush(self) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        if self.batch:
+            self.flush()
+            self.batch = []
+
+
+class CSVWriter(SurveyorWriter):
+    """
+    QUOTE_ALL, utf-8-sig csv (the original surveyor output), optionally compressed
+    """
+    def __init__(self, outf_name: str, column_names: list, compression: str=None, batch_size: int=10000) -> None:
+        super().__init__(outf_name, column_names, compression, batch_size)
+        self.outf = io.TextIOWrapper(open_binary(outf_name, compression), encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.outf, dialect=csv.excel, quoting=csv.QUOTE_ALL)
+        self.writer.writerow(self.column_names)
+
+    def flush(self) -> None:
+        self.writer.writerows(self.batch)
+
+    def close(self) -> None:
+        super().close()
+        self.outf.close()
+
+
+class JSONLinesWriter(SurveyorWriter):
+    """
+    One JSON object per row, keyed by column name; non-JSON values as strings
+    """
+    def __init__(self, outf_name: str, column_names: list, compression: str=None, batch_size: int=10000) -> None:
+        super().__init__(outf_name, column_names, compression, batch_size)
+        self.outf = io.TextIOWrapper(open_binary(outf_name, compression), encoding='utf-8', newline='\n')
+
+    def flush(self) -> None:
+        self.outf.write(''.join(json.dumps(dict(zip(self.column_names, row)), ensure_ascii=False, default=str) + '\n'
+                                for row in self.batch))
+
+    def close(self) -> None:
+        super().close()
+        self.outf.close()
+
+
+class ParquetWriter(SurveyorWriter):
+    """
+    Parquet file with one row group per batch. Column types are taken from
+    column_types (name -> pyarrow type or type name, e.g. 'int64') where given,
+    otherwise inferred from the first batch; columns that can't be typed
+    (mixed/empty) are strings. If a later batch doesn't fit an inferred type,
+    that column becomes a string column (the row groups already written are
+    copied over with it converted). Requires pyarrow.
+    """
+    def __init__(self, outf_name: str, column_names: list, compression: str=None, batch_size: int=100000,
+                       column_types: dict=None) -> None:
+        try:
+            import pyarrow, pyarrow.parquet
+        except ImportError:
+            raise ImportError("parquet output requires the pyarrow package")
+        super().__init__(outf_name, column_names, compression, batch_size)
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.column_types = { name: (pyarrow.type_for_alias(column_type) if isinstance(column_type, str) else column_type)
+                              for name, column_type in (column_types or {}).items() }
+        self.schema, self.writer = None, None
+        self.writer_filename, self.rewrites = outf_name, 0
+
+    def __column_array(self, values, column_type=None):
+        pa = self.pa
+        if column_type is None:
+            try:
+                array = pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+                array = None
+            if array is not None and array.type != pa.null():
+                return array
+            column_type = pa.string()
+        if column_type == pa.string():
+            values = [str(value) if value is not None else None for value in values]
+        return pa.array(values, type=column_type)
+
+    def __open_writer(self, filename):
+        return self.pq.ParquetWriter(filename, self.schema,
+                                     compression={GZIP: 'gzip', ZSTD: 'zstd'}.get(self.compression, 'snappy'))
+
+    def __widen_to_string(self, names) -> None:
+        # schema is fixed once written: copy what's there, with these columns as strings,
+        #   to a new file that takes over (moved into place on close)
+        self.writer.close()
+        written = self.pq.ParquetFile(self.writer_filename)
+        self.schema = self.pa.schema([(field.name, self.pa.string()) if field.name in names else field
+                                      for field in self.schema])
+        self.rewrites += 1
+        rewritten_filename = f"{self.outf_name}.{self.rewrites}.tmp"
+        self.writer = self.__open_writer(rewritten_filename)
+        for i in range(written.num_row_groups):
+            table = written.read_row_group(i)
+            arrays = [self.__column_array(column.to_pylist(), field.type) if field.name in names else column
+                      for column, field in zip(table.columns, self.schema)]
+            self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+        if self.writer_filename != self.outf_name:
+            os.remove(self.writer_filename)
+        self.writer_filename = rewritten_filename
+
+    def flush(self) -> None:
+        pa = self.pa
+        columns = [list(values) for values in zip(*self.batch)]
+        if self.schema is None:
+            arrays = [self.__column_array(values, self.column_types.get(name))
+                      for name, values in zip(self.column_names, columns)]
+            self.schema = pa.schema([(name, array.type) for name, array in zip(self.column_names, arrays)])
+            self.writer = self.__open_writer(self.outf_name)
+        else:
+            arrays, widen = [], set()
+            for values, field in zip(columns, self.schema):
+                try:
+                    arrays.append(self.__column_array(values, field.type))
+                except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+                    if field.name in self.column_types:
+                        raise ValueError(f"column {field.name}: values don't fit declared type {field.type}")
+                    arrays.append(self.__column_array(values, pa.string()))
+                    widen.add(field.name)
+            if widen:
+                self.__widen_to_string(widen)
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self) -> None:
+        super().close()
+        if self.writer is None:
+            # no rows: write an empty file with declared or all-string columns
+            self.schema = self.pa.schema([(name, self.column_types.get(name, self.pa.string())) for name in self.column_names])
+            self.writer = self.pq.ParquetWriter(self.outf_name, self.schema)
+        self.writer.close()
+        if self.writer_filename != self.outf_name:
+            os.replace(self.writer_filename, self.outf_name)
+
+
+WRITERS = { CSV     : CSVWriter,
+            JSONL   : JSONLinesWriter,
+            PARQUET : ParquetWriter }
+
+def get_writer(outf_name: str, column_names: list, output_format: str=None, compression: str=None,
+                     column_types: dict=None) -> SurveyorWriter:
+    """
+    Writer for outf_name; format/compression inferred from its extension
+    unless given. column_types only applies to typed (parquet) output.
+    """
+    inferred_format, inferred_compression = infer_output_format(outf_name)
+    output_format = output_format or inferred_format
+    if output_format not in WRITERS:
+        raise ValueError(f"invalid output_format: {output_format}")
+    writer_kwargs = {'column_types': column_types} if column_types and output_format == PARQUET else {}
+    return WRITERS[output_format](outf_name, column_names, compression or inferred_compression, **writer_kwargs)
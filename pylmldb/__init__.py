@@ -11,4 +11,4 @@ from .VoyagerAPI import VoyagerAPI
 from .LaneMARCRecord import LaneMARCRecord
 from .LmlDb import LMLDB
 # from .LmlDbSQLite import LMLDBSQLite
-from .Surveyor import Surveyor
+from .Surveyor import Surveyor, SurveyorBatch
@@ -0,0 +1,2 @@
+VOYAGER_API_ENDPOINT = VOYAGER_API_USERNAME = VOYAGER_API_PASSWORD = ''
+SQLALCHEMY_DATABASE_URI = 'sqlite://'
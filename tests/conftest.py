@@ -0,0 +1,41 @@
+import pickle
+
+import pytest
+from pymarc import Field
+
+from pylmldb.LaneMARCRecord import LaneMARCRecord
+from pylmldb.LmlDbSQLite import LMLDBSQLite
+
+
+def make_record(ctrlno, bib_ctrlno=None, note=''):
+    record = LaneMARCRecord()
+    record.add_field(Field(tag='001', data=str(ctrlno)))
+    if bib_ctrlno is not None:
+        record.add_field(Field(tag='004', data=str(bib_ctrlno)))
+    if note:
+        record.add_field(Field(tag='005', data=note))
+    return record
+
+
+@pytest.fixture
+def record_factory():
+    return make_record
+
+
+@pytest.fixture
+def row_factory():
+    """rows as produced by LmlDbIngest, with derived columns given explicitly"""
+    def make_row(record_type, ctrlno, bib_ctrlno=None, note='', identifiers=(), headings=()):
+        derived = {'identifiers': list(identifiers), 'headings': list(headings)}
+        if record_type == LMLDBSQLite.HDG:
+            derived = {'bib_ctrlno': str(bib_ctrlno)}
+        return (str(ctrlno), pickle.dumps(make_record(ctrlno, bib_ctrlno, note)), derived)
+    return make_row
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    """LMLDBSQLite reading/writing lml.db in a temp dir; returns its filename"""
+    filename = str(tmp_path / "lml.db")
+    monkeypatch.setattr(LMLDBSQLite, 'FILENAME', filename)
+    return filename
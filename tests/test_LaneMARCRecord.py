@@ -0,0 +1,30 @@
+import pytest
+
+from pylmldb.LaneMARCRecord import LaneMARCRecord
+
+
+@pytest.mark.parametrize('val, expected', [
+    ('0306406152', '9780306406157'),
+    ('0-306-40615-2', '9780306406157'),
+    ('080442957X', '9780804429573'),
+    ('080442957x (pbk.)', '9780804429573'),
+    ('9780306406157', '9780306406157'),
+    ('978-0-306-40615-7 : $25.00', '9780306406157'),
+    # check digits are not validated
+    ('0306406153', '9780306406157'),
+    ('', None),
+    ('12345', None),
+    ('97803064061', None),
+    ('X306406152', None),
+])
+def test_normalize_isbn(val, expected):
+    assert LaneMARCRecord.normalize_isbn(val) == expected
+
+
+@pytest.mark.parametrize('val, expected', [
+    ('0378-5955', '03785955'),
+    ('0317-847X', '0317847X'),
+    ('0378-595', None),
+])
+def test_normalize_issn(val, expected):
+    assert LaneMARCRecord.normalize_issn(val) == expected
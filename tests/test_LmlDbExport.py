@@ -0,0 +1,75 @@
+import gzip, json
+
+import pytest
+from pymarc import MARCReader, parse_xml_to_array
+
+from pylmldb.LmlDbExport import ParallelExport, ISO2709, MARCXML, JSONL
+from pylmldb.LmlDbSQLite import LMLDBSQLite
+
+AUT, HDG = LMLDBSQLite.AUT, LMLDBSQLite.HDG
+
+# text ctrlnos whose lexical and numeric orders differ
+CTRLNOS = [1, 2, 9, 10, 11, 19, 20, 99, 100, 101, 999, 1000, 1001, 20000]
+
+
+@pytest.fixture
+def export_mirror(mirror, row_factory):
+    with LMLDBSQLite(1) as db:
+        db.add_encoded_records(AUT, [row_factory(AUT, ctrlno) for ctrlno in CTRLNOS])
+        db.add_encoded_records(HDG, [row_factory(HDG, 5, bib_ctrlno=1)])
+    return mirror
+
+
+def test_get_ctrlno_ranges(export_mirror):
+    with LMLDBSQLite() as db:
+        assert db.get_ctrlno_ranges(AUT, 1) == [(1, 20000)]
+        assert db.get_ctrlno_ranges(AUT, 4) == [(1, 10), (11, 99), (100, 999), (1000, 20000)]
+        assert len(db.get_ctrlno_ranges(AUT, 100)) == len(CTRLNOS)
+        assert db.get_ctrlno_ranges(HDG, 4) == [(5, 5)]
+        assert db.get_ctrlno_ranges(LMLDBSQLite.BIB, 4) == []
+        # ranges cover every record exactly once
+        for n in (2, 3, 5, 13):
+            ctrlnos = [ctrlno for lo, hi in db.get_ctrlno_ranges(AUT, n)
+                       for ctrlno, _ in db.get_raw_records(AUT, ctrlno_range=(lo, hi))]
+            assert ctrlnos == [str(ctrlno) for ctrlno in CTRLNOS]
+
+
+def test_ctrlno_range_filter(export_mirror):
+    with LMLDBSQLite() as db:
+        in_range = lambda lo, hi, **kwargs: [ctrlno for ctrlno, _ in db.get_raw_records(AUT, ctrlno_range=(lo, hi), **kwargs)]
+        # inclusive at both ends, numeric not lexical
+        assert in_range(2, 100) == ['2', '9', '10', '11', '19', '20', '99', '100']
+        assert in_range(3, 8) == []
+        assert in_range(1001, 1001) == ['1001']
+        assert in_range(10, 1000, ctrlnos=['1000', '9', '11', '20000'], order='input') == ['1000', '11']
+        assert [ctrlno for ctrlno, _ in db.get_raw_records(ctrlno_range=(1, 5))] == ['1', '2', '5']
+
+
+@pytest.mark.parametrize('output_format', [ISO2709, MARCXML, JSONL])
+def test_parallel_export(export_mirror, tmp_path, output_format):
+    prefix = str(tmp_path / "lmldb")
+    results = ParallelExport(LMLDBSQLite, output_format, prefix=prefix, processes=2, shards=3).run((AUT, HDG))
+    assert sorted(results) == [f"{prefix}.{record_type}.{shard:04d}.{output_format}.gz"
+                               for record_type, shard in ((AUT, 0), (AUT, 1), (AUT, 2), (HDG, 0))]
+    assert sum(results.values()) == len(CTRLNOS) + 1
+    ctrlnos = []
+    for filename in sorted(results):
+        with gzip.open(filename, 'rb') as inf:
+            if output_format == ISO2709:
+                records = list(MARCReader(inf))
+            elif output_format == MARCXML:
+                records = parse_xml_to_array(inf)
+            else:
+                records = [json.loads(line) for line in inf]
+        assert len(records) == results[filename]
+        if output_format == JSONL:
+            ctrlnos += [field['001'] for record in records for field in record['fields'] if '001' in field]
+        else:
+            ctrlnos += [record['001'].data for record in records]
+    assert ctrlnos == [str(ctrlno) for ctrlno in CTRLNOS] + ['5']
+
+
+def test_parallel_export_uncompressed(export_mirror, tmp_path):
+    prefix = str(tmp_path / "lmldb")
+    results = ParallelExport(LMLDBSQLite, JSONL, prefix=prefix, processes=1, compress=False).run((HDG,))
+    assert results == {f"{prefix}.{HDG}.0000.jsonl": 1}
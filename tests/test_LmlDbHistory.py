@@ -0,0 +1,106 @@
+import pickle, sqlite3
+
+import pytest
+from pymarc import Field
+
+from pylmldb.LaneMARCRecord import LaneMARCRecord
+from pylmldb.LmlDbHistory import LMLDBHistory
+from pylmldb.LmlDbSQLite import LMLDBSQLite
+
+AUT, HDG = LMLDBSQLite.AUT, LMLDBSQLite.HDG
+
+
+def make_record(ctrlno, bib_ctrlno=None, note=''):
+    record = LaneMARCRecord()
+    record.add_field(Field(tag='001', data=str(ctrlno)))
+    if bib_ctrlno is not None:
+        record.add_field(Field(tag='004', data=str(bib_ctrlno)))
+    if note:
+        record.add_field(Field(tag='005', data=note))
+    return pickle.dumps(record)
+
+
+def get_note(record):
+    return record['005'].data if '005' in record else ''
+
+
+@pytest.fixture
+def history(tmp_path):
+    with LMLDBHistory(str(tmp_path / "lml.db.history")) as history:
+        # v1: full base; v2: update one, add one; v3: delete one
+        history.add_change(1, AUT, 1, make_record(1))
+        history.add_change(1, AUT, 2, make_record(2))
+        history.add_change(1, HDG, 10, make_record(10, bib_ctrlno=5))
+        history.commit_version(1, full=True)
+        history.add_change(2, AUT, 1, make_record(1, note='v2'))
+        history.add_change(2, AUT, 3, make_record(3))
+        history.commit_version(2)
+        history.add_change(3, AUT, 2, None)
+        history.commit_version(3)
+        yield history
+
+
+def test_get_record(history):
+    assert get_note(history.get_record(AUT, 1, 1)) == ''
+    assert get_note(history.get_record(AUT, 1, 3)) == 'v2'
+    assert history.get_record(AUT, 2, 2) is not None
+    assert history.get_record(AUT, 2, 3) is None
+    assert history.get_record(AUT, 3, 1) is None
+    assert history.get_record(AUT, 1, 0) is None
+
+
+def test_get_records(history):
+    assert sorted((t, c) for t, c, _ in history.get_records(2)) == [(AUT, '1'), (AUT, '2'), (AUT, '3'), (HDG, '10')]
+    assert sorted(c for _, c, _ in history.get_records(3, AUT)) == ['1', '3']
+
+
+def test_prune(history):
+    before = { version: sorted(history.get_records(version)) for version in (2, 3) }
+    history.prune(2)
+    assert history.get_versions() == [2, 3]
+    for version, records in before.items():
+        assert sorted(history.get_records(version)) == records
+    assert history.get_record(AUT, 1, 1) is None
+    # the fold is a full change set holding only records in effect at v2
+    assert [(t, c, d) for t, c, d in history.get_changes(2)] == [(AUT, '1', False), (AUT, '2', False), (AUT, '3', False), (HDG, '10', False)]
+
+
+def test_prune_after_delete(history):
+    history.prune(3)
+    assert history.get_versions() == [3]
+    assert history.get_changes(3) == [(AUT, '1', False), (AUT, '3', False), (HDG, '10', False)]
+
+
+def test_full_change_set_replaces(history):
+    history.add_change(4, AUT, 4, make_record(4))
+    history.commit_version(4, full=True)
+    assert [c for _, c, _ in history.get_records(4)] == ['4']
+    assert get_note(history.get_record(AUT, 1, 3)) == 'v2'
+
+
+def test_reconstruct(history, tmp_path):
+    filename = str(tmp_path / "lml.db.2")
+    history.reconstruct(2, filename)
+    conn = sqlite3.connect(filename)
+    assert conn.execute("SELECT type, ctrlno FROM records ORDER BY type, ctrlno;").fetchall() == \
+               [(AUT, '1'), (AUT, '2'), (AUT, '3'), (HDG, '10')]
+    assert get_note(pickle.loads(conn.execute("SELECT record FROM records WHERE ctrlno = '1';").fetchone()[0])) == 'v2'
+    assert conn.execute("SELECT * FROM holdings_links;").fetchall() == [('10', '5')]
+    assert conn.execute("SELECT version FROM version;").fetchall() == [(2,)]
+    conn.close()
+
+
+def test_attached_commits_with_mirror(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "lml.db"))
+    LMLDBSQLite.create_tables(conn)
+    history = LMLDBHistory(str(tmp_path / "lml.db.history"), conn=conn)
+    conn.execute("INSERT INTO records VALUES (?, ?, ?);", (AUT, '1', make_record(1)))
+    history.add_change(1, AUT, 1, make_record(1))
+    conn.rollback()
+    history.commit_version(1, full=True)
+    assert list(history.get_records(1)) == []
+    history.seed(2, conn.execute("SELECT type, ctrlno, record FROM records;"))
+    history.close()
+    conn.close()
+    with LMLDBHistory(str(tmp_path / "lml.db.history")) as history:
+        assert history.get_versions() == [1, 2]
@@ -0,0 +1,58 @@
+import io
+
+import pytest
+
+from pylmldb.LmlDbHistory import LMLDBHistory
+from pylmldb.LmlDbIngest import split_marc_records
+from pylmldb.LmlDbSQLite import LMLDBSQLite
+
+AUT, HDG = LMLDBSQLite.AUT, LMLDBSQLite.HDG
+
+
+@pytest.fixture
+def raw_records(record_factory):
+    return [record_factory(ctrlno).as_marc() for ctrlno in (1, 22, 333)]
+
+
+def test_split(raw_records):
+    assert list(split_marc_records(io.BytesIO(b''.join(raw_records)))) == raw_records
+    assert list(split_marc_records(io.BytesIO(b''))) == []
+
+
+def test_split_whitespace_between_records(raw_records):
+    data = b'\n'.join(raw_records) + b'\r\n\x1a'
+    assert list(split_marc_records(io.BytesIO(b' \t' + data))) == raw_records
+    assert list(split_marc_records(io.BytesIO(raw_records[0] + b'\x1a\x1a' + raw_records[1]))) == raw_records[:2]
+
+
+def test_split_truncated_last_record(raw_records):
+    records = split_marc_records(io.BytesIO(b''.join(raw_records)[:-10]))
+    assert next(records) == raw_records[0]
+    assert next(records) == raw_records[1]
+    with pytest.raises(ValueError, match="truncated"):
+        next(records)
+
+
+def test_split_non_digit_length(raw_records):
+    with pytest.raises(ValueError, match="invalid record length"):
+        list(split_marc_records(io.BytesIO(b'00a12' + raw_records[0][5:])))
+    records = split_marc_records(io.BytesIO(raw_records[0] + b'junk!' + raw_records[1]))
+    assert next(records) == raw_records[0]
+    with pytest.raises(ValueError, match="invalid record length"):
+        next(records)
+
+
+def test_populate_parallel(mirror, record_factory):
+    auts = b''.join(record_factory(ctrlno).as_marc() for ctrlno in range(1, 51))
+    hdgs = b''.join(record_factory(ctrlno, bib_ctrlno=ctrlno % 7).as_marc() for ctrlno in range(100, 120))
+    with LMLDBSQLite(1) as db:
+        ctrlnos = db.populate_parallel(AUT, io.BytesIO(auts), processes=2, batch_size=8, progress=False)
+        assert sorted(ctrlnos, key=int) == [str(ctrlno) for ctrlno in range(1, 51)]
+        db.populate_parallel(HDG, io.BytesIO(hdgs), processes=2, batch_size=8, max_pending=1, progress=False)
+    with LMLDBSQLite() as db:
+        assert [(ctrlno, record['001'].data) for ctrlno, record in db.get_auts()] == \
+                   [(str(ctrlno), str(ctrlno)) for ctrlno in range(1, 51)]
+        assert db.get_hdgs_for_bib('3') == ['101', '108', '115']
+    with LMLDBHistory(f"{mirror}.history") as history:
+        assert history.get_record(AUT, 50, 1)['001'].data == '50'
+        assert len(list(history.get_records(1))) == 70
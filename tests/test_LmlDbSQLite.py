@@ -0,0 +1,213 @@
+import os, sqlite3
+
+import pytest
+
+from pylmldb.LmlDbHistory import LMLDBHistory
+from pylmldb.LmlDbSQLite import LMLDBSQLite
+
+BIB, AUT, HDG = LMLDBSQLite.BIB, LMLDBSQLite.AUT, LMLDBSQLite.HDG
+
+
+def history_ctrlnos(mirror, version):
+    with LMLDBHistory(f"{mirror}.history") as history:
+        return sorted(ctrlno for _, ctrlno, _ in history.get_records(version))
+
+
+def mirror_ctrlnos(record_type):
+    with LMLDBSQLite() as db:
+        return [ctrlno for ctrlno, _ in db.get_raw_records(record_type)]
+
+
+# ~~~~~~ HISTORY ~~~~~~
+
+def test_history_tracks_updates(mirror, row_factory):
+    with LMLDBSQLite(1) as db:
+        db.add_encoded_records(BIB, [row_factory(BIB, 1), row_factory(BIB, 2)])
+    with LMLDBSQLite(2) as db:
+        db.add_encoded_records(BIB, [row_factory(BIB, 3)])
+        db.delete_records(BIB, ['1'])
+    assert history_ctrlnos(mirror, 1) == ['1', '2']
+    assert history_ctrlnos(mirror, 2) == ['2', '3'] == mirror_ctrlnos(BIB)
+
+
+def test_missing_mirror_is_full_change_set(mirror, row_factory):
+    with LMLDBSQLite(3) as db:
+        db.add_encoded_records(BIB, [row_factory(BIB, 9999)])
+    os.remove(mirror)
+    with LMLDBSQLite(4) as db:
+        db.add_encoded_records(BIB, [row_factory(BIB, 8888)])
+    assert mirror_ctrlnos(BIB) == ['8888']
+    assert history_ctrlnos(mirror, 4) == ['8888']
+    assert history_ctrlnos(mirror, 3) == ['9999']
+
+
+def test_reinit_same_version_replaces(mirror, row_factory):
+    with LMLDBSQLite(5, reinit=True) as db:
+        db.add_encoded_records(BIB, [row_factory(BIB, 1), row_factory(BIB, 2)])
+    with LMLDBSQLite(5, reinit=True) as db:
+        db.add_encoded_records(BIB, [row_factory(BIB, 3)])
+    assert history_ctrlnos(mirror, 5) == ['3'] == mirror_ctrlnos(BIB)
+
+
+def test_existing_mirror_seeds_history(mirror, row_factory):
+    with LMLDBSQLite(1) as db:
+        db.add_encoded_records(AUT, [row_factory(AUT, 1)])
+    os.remove(f"{mirror}.history")
+    with LMLDBSQLite(2) as db:
+        db.add_encoded_records(AUT, [row_factory(AUT, 2)])
+    with LMLDBHistory(f"{mirror}.history") as history:
+        assert history.get_versions() == [1, 2]
+    assert history_ctrlnos(mirror, 1) == ['1']
+    assert history_ctrlnos(mirror, 2) == ['1', '2']
+
+
+def test_read_only_session_cannot_write(mirror, row_factory):
+    with LMLDBSQLite(1) as db:
+        pass
+    with LMLDBSQLite() as db:
+        with pytest.raises(AssertionError):
+            db.add_encoded_records(AUT, [row_factory(AUT, 1)])
+        with pytest.raises(AssertionError):
+            db.populate(AUT, [])
+
+
+# ~~~~~~ LARGE CTRLNO/VALUE SETS ~~~~~~
+
+@pytest.fixture
+def large_set_mirror(mirror, row_factory, monkeypatch):
+    # anything over 3 goes through a temp table
+    monkeypatch.setattr(LMLDBSQLite, 'LARGE_CTRLNO_SET', 3)
+    with LMLDBSQLite(1) as db:
+        db.add_encoded_records(BIB, [row_factory(BIB, ctrlno, identifiers=[(LMLDBSQLite.ISSN, f"0000000{ctrlno % 3}")])
+                                     for ctrlno in (2, 9, 10, 11, 100)])
+    return mirror
+
+
+def test_large_set_ctrlno_order(large_set_mirror):
+    with LMLDBSQLite() as db:
+        ctrlnos = ['100', '10', '2', '11', '9', '10', '404']
+        assert [ctrlno for ctrlno, _ in db.get_raw_records(BIB, ctrlnos)] == ['2', '9', '10', '11', '100']
+        assert [record['001'].data for _, record in db.get_bibs(ctrlnos)] == ['2', '9', '10', '11', '100']
+
+
+def test_large_set_input_order(large_set_mirror):
+    with LMLDBSQLite() as db:
+        ctrlnos = ['100', '10', '2', '11', '9', '10', '404']
+        assert [ctrlno for ctrlno, _ in db.get_raw_records(BIB, ctrlnos, order='input')] == ['100', '10', '2', '11', '9']
+        # small set, same order
+        assert [ctrlno for ctrlno, _ in db.get_raw_records(BIB, ['100', '2', '100'], order='input')] == ['100', '2']
+
+
+def test_large_set_interleaved_and_reused(large_set_mirror):
+    with LMLDBSQLite() as db:
+        outer = db.get_raw_records(BIB, ['2', '9', '10', '11'])
+        assert next(outer)[0] == '2'
+        inner = [ctrlno for ctrlno, _ in db.get_raw_records(BIB, ['100', '11', '10', '9'], order='input')]
+        assert inner == ['100', '11', '10', '9']
+        assert [ctrlno for ctrlno, _ in outer] == ['9', '10', '11']
+        assert [ctrlno for ctrlno, _ in db.get_raw_records(BIB, ['9', '10', '11', '100'])] == ['9', '10', '11', '100']
+
+
+def test_large_identifier_set(large_set_mirror):
+    with LMLDBSQLite() as db:
+        issns = ['0000-0000', '0000-0001', '00000002', '0000-0003', '0000000X', 'bad', '0000-0001']
+        assert db.get_bibs_for_issns(issns) == {'00000000': ['9'], '00000001': ['10', '100'], '00000002': ['11', '2']}
+
+
+def test_large_set_releases_lock(large_set_mirror):
+    with LMLDBSQLite() as db:
+        assert len(list(db.get_raw_records(BIB, ['2', '9', '10', '11']))) == 4
+        db.get_bibs_for_issns(['00000000', '00000001', '00000002', '00000003'])
+        assert not db.conn.in_transaction
+        # another writer isn't blocked by the session
+        writer = sqlite3.connect(large_set_mirror, timeout=0)
+        writer.execute("UPDATE version SET version = 2;")
+        writer.commit()
+        writer.close()
+
+
+def test_large_set_keeps_write_transaction(large_set_mirror):
+    with LMLDBSQLite(2) as db:
+        db.cur.execute("DELETE FROM records WHERE ctrlno = '2';")
+        assert [ctrlno for ctrlno, _ in db.get_raw_records(BIB, ['2', '9', '10', '11'])] == ['9', '10', '11']
+        assert db.conn.in_transaction
+        db.conn.rollback()
+        assert [ctrlno for ctrlno, _ in db.get_raw_records(BIB, ['2', '9', '10', '11'])] == ['2', '9', '10', '11']
+
+
+def test_default_large_set(mirror, row_factory):
+    with LMLDBSQLite(1) as db:
+        db.add_encoded_records(AUT, [row_factory(AUT, ctrlno) for ctrlno in range(1, 1501)])
+    with LMLDBSQLite() as db:
+        ctrlnos = [str(ctrlno) for ctrlno in range(2000, 0, -1)]
+        assert len(ctrlnos) > db.LARGE_CTRLNO_SET
+        assert [ctrlno for ctrlno, _ in db.get_raw_records(AUT, ctrlnos)] == [str(ctrlno) for ctrlno in range(1, 1501)]
+        assert [ctrlno for ctrlno, _ in db.get_raw_records(AUT, ctrlnos, order='input')] == [str(ctrlno) for ctrlno in range(1500, 0, -1)]
+
+
+# ~~~~~~ HEADING INDEX ~~~~~~
+
+@pytest.fixture
+def heading_mirror(mirror, row_factory):
+    with LMLDBSQLite(1) as db:
+        db.create_heading_index()
+        db.add_encoded_records(AUT, [row_factory(AUT, 1, headings=[('PER', False, 'smith john 1900 1980'),
+                                                                   ('PER', True, 'smyth jon')]),
+                                     row_factory(AUT, 2, headings=[('ORG', False, 'smithsonian institution')]),
+                                     row_factory(AUT, 3, headings=[('CON', False, 'neoplasms')])])
+        db.add_encoded_records(BIB, [row_factory(BIB, 1, headings=[('WRK', False, 'john smith papers')])])
+    return mirror
+
+
+def search(db, query, **kwargs):
+    return [(record_type, ctrlno) for record_type, ctrlno, _, _, _ in db.search_headings(query, **kwargs)]
+
+
+def check_fts_integrity(db):
+    db.cur.execute("INSERT INTO headings_fts (headings_fts) VALUES ('integrity-check');")
+
+
+def test_search_headings(heading_mirror):
+    with LMLDBSQLite() as db:
+        assert db.use_heading_index
+        assert sorted(search(db, 'Smith', prefix=False)) == [(AUT, '1'), (BIB, '1')]
+        assert sorted(search(db, 'smi')) == [(AUT, '1'), (AUT, '2'), (BIB, '1')]
+        assert search(db, 'smi', prefix=False) == []
+        assert sorted(search(db, 'smi', record_type=AUT)) == [(AUT, '1'), (AUT, '2')]
+        assert search(db, 'smi', record_type=AUT, element_types=('ORG',)) == [(AUT, '2')]
+        assert search(db, 'Smyth, Jon') == [(AUT, '1')]
+        assert db.search_headings('smyth') == [(AUT, '1', 'PER', 'smyth jon', True)]
+        assert search(db, 'neoplasm john') == []
+        assert db.search_headings('  ') == []
+
+
+def test_heading_index_follows_changes(heading_mirror, row_factory):
+    with LMLDBSQLite(2) as db:
+        db.delete_records(AUT, ['1'])
+        db.add_encoded_records(AUT, [row_factory(AUT, 2, headings=[('ORG', False, 'smithsonian libraries')])])
+        db.add_encoded_records(AUT, [row_factory(AUT, 4, headings=[('PER', False, 'smith jane')])])
+    with LMLDBSQLite() as db:
+        check_fts_integrity(db)
+        assert sorted(search(db, 'smi', record_type=AUT)) == [(AUT, '2'), (AUT, '4')]
+        assert search(db, 'smyth') == []
+        assert search(db, 'institution') == []
+        assert search(db, 'libraries') == [(AUT, '2')]
+        assert db.cur.execute("SELECT count(*) FROM headings WHERE type = ?;", (AUT,)).fetchone()[0] == 3
+
+
+def test_heading_index_kept_through_reinit(heading_mirror, row_factory):
+    with LMLDBSQLite(2, reinit=True) as db:
+        assert db.use_heading_index
+        db.add_encoded_records(AUT, [row_factory(AUT, 5, headings=[('PER', False, 'doe jane')])])
+    with LMLDBSQLite() as db:
+        check_fts_integrity(db)
+        assert search(db, 'doe') == [(AUT, '5')]
+        assert search(db, 'smith') == []
+
+
+def test_no_heading_index(mirror, row_factory):
+    with LMLDBSQLite(1, reinit=True) as db:
+        assert not db.use_heading_index
+        db.add_encoded_records(AUT, [row_factory(AUT, 1)])
+        with pytest.raises(AssertionError):
+            db.search_headings('smith')
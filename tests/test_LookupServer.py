@@ -0,0 +1,109 @@
+import asyncio, json, socket
+
+import pytest
+
+from pylmldb.LookupServer import LMLDBLookupServer, LookupRequestError
+
+
+class FakeRecord:
+    def __init__(self, ctrlno):
+        self.ctrlno = ctrlno
+
+    def as_dict(self):
+        return {'001': self.ctrlno}
+
+
+class FakeDB:
+    def __init__(self, version=1):
+        self.version = version
+        self.map_fetches = 0
+        self.bib_to_hdg_map, self.hdg_to_bib_map = {}, {}
+
+    def get_version(self):
+        if isinstance(self.version, Exception):
+            raise self.version
+        return self.version
+
+    def fetch_and_cache_bib_hdg_maps(self):
+        self.map_fetches += 1
+
+    def get_records(self, record_type, ctrlnos):
+        for ctrlno in ctrlnos:
+            int(ctrlno)
+            yield ctrlno, FakeRecord(ctrlno)
+
+
+def request(server, *request_lines):
+    """raw requests over a real connection; returns list of (status, body)"""
+    async def run():
+        server_sock, client_sock = socket.socketpair()
+        reader, writer = await asyncio.open_connection(sock=server_sock)
+        client_sock.sendall(b''.join(line.encode('latin-1') + b'\r\n\r\n' for line in request_lines))
+        client_sock.shutdown(socket.SHUT_WR)
+        await server.handle_connection(reader, writer)
+        await writer.wait_closed()
+        data = b''
+        while chunk := client_sock.recv(65536):
+            data += chunk
+        client_sock.close()
+        return data
+    responses, data = [], asyncio.run(run())
+    while data:
+        head, _, data = data.partition(b'\r\n\r\n')
+        length = int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0])
+        responses.append((int(head.split()[1]), json.loads(data[:length])))
+        data = data[length:]
+    return responses
+
+
+def lookup_status(server, path, params={}):
+    try:
+        server.lookup(path, params)
+    except LookupRequestError as e:
+        return e.status
+    return 200
+
+
+def test_invalid_ctrlnos():
+    server = LMLDBLookupServer(FakeDB())
+    assert server.lookup('/record/bib/123', {}) == {'001': '123'}
+    assert lookup_status(server, '/record/bib/x') == 400
+    assert lookup_status(server, '/record/bib/12%0A') == 400
+    assert server.lookup('/records/bib', {'ctrlnos': ['1,2']}) == {'1': {'001': '1'}, '2': {'001': '2'}}
+    assert lookup_status(server, '/records/bib', {'ctrlnos': ['1,x']}) == 400
+
+
+def test_http():
+    server = LMLDBLookupServer(FakeDB())
+    assert request(server, 'GET /record/bib/123 HTTP/1.1',
+                           'GET /record/bib/x HTTP/1.1',
+                           'GET /records/bib?ctrlnos=1,2 HTTP/1.1',
+                           'POST /record/bib/1 HTTP/1.1',
+                           'GET /nowhere HTTP/1.1') == \
+               [(200, {'001': '123'}),
+                (400, {'error': 'invalid ctrlno: x'}),
+                (200, {'1': {'001': '1'}, '2': {'001': '2'}}),
+                (405, {'error': 'method not allowed: POST'}),
+                (404, {'error': 'unknown endpoint: /nowhere'})]
+    assert server.lookup('/metrics', {})['errors'] == 3
+
+
+def test_version_check_throttled_when_unavailable():
+    db = FakeDB(version=RuntimeError("no version"))
+    server = LMLDBLookupServer(db, version_check_interval=60)
+    for _ in range(5):
+        server.lookup('/record/bib/1', {})
+    assert db.map_fetches == 1
+    assert len(server.cache) == 1
+
+
+def test_version_change_invalidates():
+    db = FakeDB()
+    server = LMLDBLookupServer(db, version_check_interval=0)
+    server.lookup('/record/bib/1', {})
+    server.lookup('/record/bib/2', {})
+    assert db.map_fetches == 1 and len(server.cache) == 2
+    db.version = 2
+    server.lookup('/record/bib/1', {})
+    assert db.map_fetches == 2 and len(server.cache) == 1
+    assert server.metrics['invalidations'] == 1
@@ -0,0 +1,124 @@
+import functools, os, subprocess, sys
+
+import pytest
+
+from pylmldb.LmlDbSQLite import LMLDBSQLite
+from pylmldb.Surveyor import Surveyor, SurveyorBatch
+
+REPORT = """
+import functools
+from pylmldb.Surveyor import Surveyor
+def has_tag(tag, c, p, s, t):
+    return tag in p
+def in_subset(subsets=frozenset({'Print', 'Digital', 'Video'})):
+    return lambda c, p, s, t: bool(subsets & set(p.get_subsets()))
+surveyor = Surveyor(Surveyor.BIB,
+                    filters=[in_subset(), functools.partial(has_tag, '245')],
+                    columns={'id': lambda c, p, s, t: c,
+                             'n': lambda c, p, s, t, n={'a', 'b', 'c'}: len(n)})
+print(surveyor.get_fingerprint())
+"""
+
+
+def test_fingerprint_stable_across_processes():
+    fingerprints = set()
+    for seed in ('1', '2', '3'):
+        fingerprints.add(subprocess.run([sys.executable, '-c', REPORT], check=True, capture_output=True,
+                                        env=dict(os.environ, PYTHONHASHSEED=seed)).stdout)
+    assert len(fingerprints) == 1
+
+
+def test_fingerprint_changes_with_definition():
+    make = lambda **kwargs: Surveyor(Surveyor.BIB, filters=[], columns=dict(kwargs))
+    assert make(id=lambda c, p, s, t: c).get_fingerprint() == make(id=lambda c, p, s, t: c).get_fingerprint()
+    assert make(id=lambda c, p, s, t: c).get_fingerprint() != make(id=lambda c, p, s, t: p).get_fingerprint()
+    assert make(n=lambda c, p, s, t, n=1: n).get_fingerprint() != make(n=lambda c, p, s, t, n=2: n).get_fingerprint()
+    def closure(tag):
+        return lambda c, p, s, t: tag
+    assert make(tag=closure('100')).get_fingerprint() != make(tag=closure('245')).get_fingerprint()
+
+
+def test_fingerprint_unhashable_closure():
+    obj = object()
+    surveyor = Surveyor(Surveyor.BIB, filters=[], columns={'obj': lambda c, p, s, t: obj})
+    with pytest.raises(ValueError):
+        surveyor.get_fingerprint()
+    surveyor.report_version = '1'
+    assert surveyor.get_fingerprint() != Surveyor(Surveyor.BIB, filters=[], columns={'obj': lambda c, p, s, t: obj},
+                                                  report_version='2').get_fingerprint()
+
+
+def test_fingerprint_callable_without_code():
+    surveyor = Surveyor(Surveyor.BIB, filters=[callable], columns={'id': functools.partial(str)})
+    assert surveyor.get_fingerprint() == Surveyor(Surveyor.BIB, filters=[callable],
+                                                  columns={'id': functools.partial(str)}).get_fingerprint()
+
+
+# ~~~~~~ BATCH ~~~~~~
+
+EVALUATED = []
+
+def get_note(record):
+    return record['005'].data if '005' in record else ''
+
+def odd_bibs():
+    return Surveyor(Surveyor.BIB, filters=[lambda c, p, s, t: int(c) % 2 == 1],
+                    columns={'id': lambda c, p, s, t: c,
+                             'hdgs': lambda c, p, s, t: ' '.join(sorted(h['001'].data for h in s)),
+                             'hdg notes': lambda c, p, s, t: EVALUATED.append(c) or ' '.join(sorted(get_note(h) for h in s if get_note(h)))},
+                    use_crossreferencing=True)
+
+def all_bibs():
+    return Surveyor(Surveyor.BIB, columns={'id': lambda c, p, s, t: c, 'note': lambda c, p, s, t: get_note(p)})
+
+def hdgs():
+    return Surveyor(Surveyor.HDG, columns={'id': lambda c, p, s, t: c, 'bibs': lambda c, p, s, t: ' '.join(b['001'].data for b in s)},
+                    use_crossreferencing=True)
+
+
+@pytest.fixture
+def surveyor_mirror(mirror, row_factory, monkeypatch):
+    monkeypatch.setattr(sys.modules['pylmldb.Surveyor'], 'LMLDB', LMLDBSQLite)
+    with LMLDBSQLite(1) as db:
+        db.add_encoded_records(LMLDBSQLite.BIB, [row_factory(LMLDBSQLite.BIB, ctrlno, note=f"b{ctrlno}") for ctrlno in range(1, 7)])
+        db.add_encoded_records(LMLDBSQLite.HDG, [row_factory(LMLDBSQLite.HDG, ctrlno, bib_ctrlno=ctrlno % 4 + 1)
+                                                 for ctrlno in range(100, 109)])
+    return mirror
+
+
+def read(filename):
+    with open(filename, encoding='utf-8-sig') as inf:
+        return inf.read()
+
+
+def test_batch_matches_separate_reports(surveyor_mirror, tmp_path):
+    reports = { 'odd_bibs': odd_bibs(), 'all_bibs': all_bibs(), 'hdgs': hdgs() }
+    for name, surveyor in reports.items():
+        surveyor.run_report(str(tmp_path / f"{name}.csv"))
+    SurveyorBatch([(surveyor, str(tmp_path / f"{name}.batch.csv"), None, None)
+                   for name, surveyor in reports.items()]).run()
+    for name in reports:
+        assert read(tmp_path / f"{name}.batch.csv") == read(tmp_path / f"{name}.csv")
+    assert read(tmp_path / "odd_bibs.csv").splitlines()[1:] == \
+               ['"1","100 104 108",""', '"3","102 106",""', '"5","",""']
+    assert read(tmp_path / "hdgs.csv").splitlines()[1] == '"100","1"'
+
+
+def test_batch_cache_reuse_and_invalidation(surveyor_mirror, row_factory, tmp_path):
+    outf_name, cache_filename = str(tmp_path / "odd_bibs.csv"), str(tmp_path / "cache.db")
+    run = lambda: SurveyorBatch([(odd_bibs(), outf_name, cache_filename, None),
+                                 (all_bibs(), str(tmp_path / "all_bibs.csv"), None, None)]).run()
+    EVALUATED.clear()
+    run()
+    first = read(outf_name)
+    assert sorted(EVALUATED) == ['1', '3', '5']
+    EVALUATED.clear()
+    run()
+    assert EVALUATED == []
+    assert read(outf_name) == first
+    # a linked holdings record changes: only its bib is recomputed
+    with LMLDBSQLite(2) as db:
+        db.add_encoded_records(LMLDBSQLite.HDG, [row_factory(LMLDBSQLite.HDG, 106, bib_ctrlno=3, note='h106')])
+    run()
+    assert EVALUATED == ['3']
+    assert '"3","102 106","h106"' in read(outf_name).splitlines()
@@ -0,0 +1,37 @@
+import pytest
+
+from pylmldb.SurveyorWriters import infer_output_format, get_writer, ParquetWriter
+
+
+def test_infer_output_format():
+    assert infer_output_format('report.csv') == ('csv', None)
+    assert infer_output_format('report.jsonl.gz') == ('jsonl', 'gz')
+    assert infer_output_format('report.parquet') == ('parquet', None)
+    assert infer_output_format('report') == ('csv', None)
+
+
+def test_parquet_widens_column_to_string(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    filename = str(tmp_path / "report.parquet")
+    with ParquetWriter(filename, ['id', 'year', 'count'], batch_size=2) as writer:
+        for row in (['1', 1999, 1], ['2', 2001, 2], ['3', '[2003?]', 3], ['4', 2004, 4], ['5', None, 'x']):
+            writer.write_row(row)
+    table = pq.read_table(filename)
+    assert str(table.schema.field('year').type) == 'string'
+    assert str(table.schema.field('count').type) == 'string'
+    assert table.column('year').to_pylist() == ['1999', '2001', '[2003?]', '2004', None]
+    assert table.column('count').to_pylist() == ['1', '2', '3', '4', 'x']
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['report.parquet']
+
+
+def test_parquet_declared_types(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    filename = str(tmp_path / "report.parquet")
+    with get_writer(filename, ['id', 'year'], column_types={'id': 'string', 'year': pa.int32()}) as writer:
+        writer.write_row([1, None])
+        writer.write_row([2, 2001])
+    assert pq.read_table(filename).schema.types == [pa.string(), pa.int32()]
+    writer = ParquetWriter(filename, ['year'], batch_size=1, column_types={'year': 'int64'})
+    with pytest.raises(ValueError):
+        writer.write_row(['[2003?]'])